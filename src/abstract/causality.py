@@ -105,14 +105,16 @@ class SignalEmitter (Persistent):
     def emit (self, signal):
         """ Emits signal to all listeners in all linked rooms"""
         for room in self.transmissionarea :
-            for listener in room.listeners:
-                listener.signalReceived(signal)
+            self.emitInRoom(signal, room)
         
     
     def emitInRoom (self, signal, room):
-        """ Emits signal to all listeners in room"""
+        """ Emits signal to all listeners in room, that
+        subscribed to its type (see SignalListener.signaltypes)"""
         for listener in room.listeners:
-            listener.signalReceived(signal)
+            types = listener.signaltypes
+            if types is None or isinstance(signal, types):
+                listener.signalReceived(signal)
         
 class SignalListener (Persistent):
      
@@ -124,6 +126,10 @@ class SignalListener (Persistent):
     
     Listens to Signals. Interface specification.
     """
+    
+    signaltypes = None
+    """ tuple of Signal types, the listener receives. None
+    means every signal """
  
     def __init__ (self): 
         Persistent.__init__(self)
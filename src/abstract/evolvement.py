@@ -16,7 +16,10 @@
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
 from basic.exceptions import *
-from engine.ormapping import Persistent, Integer, PickleType
+from engine.ormapping import Store, Persistent, Integer, PickleType, Elapsing
+from engine.tick import PhasedCall
+from engine.timers import TimerWheel
+from array import array
 
 class Improvable (Persistent):
     
@@ -38,12 +41,32 @@ class Improvable (Persistent):
     quality    = Integer()
     maxquality = Integer()
     
+    regenerationrate = 0
+    """ quality gained per tick of the Regeneration engine.
+    0 disables regeneration """
+    
     def __init__ (self):
         Persistent.__init__(self)
         self.quality = 0
         self.maxquality = 0
 
 
+    def __delete__ (self):
+        """ [overwritten] stops regenerating the object """
+        Regeneration().untrack(self)
+        Persistent.__delete__(self)
+
+
+    def __rollback__ (self):
+        """ [overwritten] regenerates objects again, whose 
+        deletion was rolled back """
+        Persistent.__rollback__(self)
+        if (self.regenerationrate and 
+            Store().objects.get(self.id) is self and
+            self.quality < self.maxquality):
+            Regeneration().track(self)
+
+
     def getPercentage (self):    
         qfloat = float(self.quality)
         if not self.maxquality :
@@ -109,6 +132,9 @@ class Improvable (Persistent):
         
         self.quality = nq
         
+        if self.regenerationrate and nq < self.maxquality:
+            Regeneration().track(self)
+        
         if not nq :
             self.qualityMinimum(actor)
 
@@ -204,6 +230,230 @@ class GradualImprovable (Improvable):
         """For convenience. Resets quality to current level minimum """
         
         self.quality = self.levelstops[self.level]
+
+
+class LazyImprovable (Improvable):
+    
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+    
+    Improvable, whose quality changes with time at a given rate
+    (regeneration, decay, spoilage, burning light sources) 
+    without being ticked. The quality is computed on read and
+    only written on improve/impair. qualityMaximum and 
+    qualityMinimum are invoked (with actor None), when the 
+    quality reaches a bound over time.
+    
+    @note: Don't combine this with regenerationrate
+    """
+    
+    drift = Elapsing()
+    
+    def __postload__ (self):
+        self.scheduleThreshold()
+    
+    
+    def __rollback__ (self):
+        """ [overwritten] reschedules the threshold for the
+        restored quality and rate """
+        Improvable.__rollback__(self)
+        self.scheduleThreshold()
+    
+    
+    def getQuality (self):
+        return min(max(self.drift, 0), self.maxquality)
+    
+    
+    def setQuality (self, quality):
+        self.drift = quality
+        # keep the quality column up to date as well
+        Improvable.__dict__["quality"].__set__(self, quality)
+        self.scheduleThreshold()
+    
+    quality = property(fget = getQuality, fset = setQuality, \
+                       doc  = "Current quality")
+    
+    
+    def getDriftRate (self):
+        return self.getRate("drift")
+    
+    
+    def setDriftRate (self, rate):
+        self.setQuality(self.quality)
+        self.setRate("drift", rate)
+        self.scheduleThreshold()
+    
+    rate = property(fget = getDriftRate, fset = setDriftRate, \
+                    doc  = "Quality change per second (may be negative)")
+    
+    
+    def scheduleThreshold (self):
+        """ [internal] schedules thresholdReached for the time
+        the quality will hit 0 or maxquality. If the bound was
+        reached unnoticed (e.g. while the server was down), 
+        thresholdReached is invoked at once """
+        timer = self.__dict__.get("_threshold")
+        if timer and timer.active():
+            timer.cancel()
+        self._threshold = None
+        
+        rate = self.rate
+        if not rate:
+            return
+        
+        quality = self.quality
+        if rate > 0 and quality < self.maxquality:
+            delay = (self.maxquality - quality) / float(rate)
+        elif rate < 0 and quality > 0:
+            delay = quality / float(-rate)
+        else :
+            # the quality column holds the bound, once the
+            # event methods were invoked (see thresholdReached)
+            stored = Improvable.__dict__["quality"].__get__(self, type(self))
+            if stored == quality:
+                return
+            delay = 0
+        
+        self._threshold = TimerWheel().callLater(delay, self.thresholdReached)
+    
+    
+    def thresholdReached (self):
+        """ [internal] materializes the quality and invokes
+        the event methods """
+        self._threshold = None
+        quality = self.quality
+        Improvable.__dict__["quality"].__set__(self, quality)
+        self.drift = quality
         
+        if not quality :
+            self.qualityMinimum(None)
+        elif quality >= self.maxquality:
+            self.qualityMaximum(None)
 
 
+class Regeneration (object):
+    
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+    
+    Regenerates Improvables with a regenerationrate in bulk. 
+    Objects below maximum are tracked in compact arrays. Once
+    per tick every tracked quality is raised, qualityMaximum
+    is invoked for objects, that reached their maximum, and
+    all changes are written at once. 
+    
+    Impaired objects are tracked automatically, call trackAll
+    after loading the store. Like Store, all instances share
+    their state.
+    
+    @note: qualityChanged is not invoked by ticks
+    """
+    
+    __shared_state = {}
+    
+    def __init__ (self):
+        self.__dict__ = Regeneration.__shared_state
+        if not self.__dict__:
+            self.objects = []
+            self.rates   = array("d")
+            self.indices = {}
+            self.loop    = PhasedCall("regen", self.run)
+    
+    
+    def start (self, interval):
+        """ starts ticking every interval seconds """
+        self.loop.start(interval, now=False)
+    
+    
+    def stop (self):
+        self.loop.stop()
+    
+    
+    def track (self, o):
+        """ regenerates o until it reaches its maximum """
+        if o in self.indices:
+            return
+        self.indices[o] = len(self.objects)
+        self.objects.append(o)
+        self.rates.append(o.regenerationrate)
+    
+    
+    def untrack (self, o):
+        """ stops regenerating o """
+        i = self.indices.pop(o, None)
+        if i is None:
+            return
+        
+        # swap with the last entry to keep the arrays compact
+        last = self.objects.pop()
+        rate = self.rates.pop()
+        if last is not o:
+            self.objects[i] = last
+            self.rates[i]   = rate
+            self.indices[last] = i
+    
+    
+    def trackAll (self):
+        """ tracks every Improvable below maximum, that has
+        a regenerationrate """
+        s = Store()
+        idtuples = s.cursor.execute("select id from Improvable " +
+                                    "where _quality < _maxquality").fetchall()
+        for tuple in idtuples:
+            o = s.objects[tuple[0]]
+            if o.regenerationrate:
+                self.track(o)
+    
+    
+    def run (self):
+        """ LoopingCall method. Applies one tick """
+        tracked = self.objects
+        rates   = self.rates
+        rows    = []
+        done    = []
+        reached = []
+        
+        objects = Store().objects
+        for i in range(len(tracked)):
+            o = tracked[i]
+            
+            # deleted meanwhile
+            if objects.get(o.id) is not o:
+                done.append(o)
+                continue
+            
+            d = o.__dict__
+            quality = d["_quality"]
+            maximum = d["_maxquality"]
+            
+            # improved by someone else meanwhile
+            if quality >= maximum:
+                done.append(o)
+                continue
+            
+            nq = min(quality + rates[i], maximum)
+            if nq == int(nq):
+                nq = int(nq)
+            # journaled, if a unit of work is running
+            o.__remember__("_quality")
+            d["_quality"] = nq
+            rows.append((nq, o.id))
+            
+            if nq >= maximum:
+                reached.append(o)
+        
+        if rows:
+            Store().updateMany("Improvable", "_quality", rows)
+        
+        for o in done + reached:
+            self.untrack(o)
+        
+        # only transitions fire the event
+        for o in reached:
+            o.qualityMaximum(None)
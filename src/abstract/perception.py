@@ -13,8 +13,8 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
-from engine.ormapping import Persistent, PickleType, Reference 
-from engine.ormapping import Boolean, String, BackRef
+from engine.ormapping import Persistent, Reference, Boolean, BackRef
+from engine.ormapping import InheritableString, InheritablePickleType
 from abstract.exceptions import *
 
 
@@ -28,11 +28,14 @@ class Addressable (Persistent):
     @version: 0.1
     @since: 0.1
     
-    Makes an object answer to a string representation
+    Makes an object answer to a string representation. Keywords
+    fall through to the prototype, if the object has none
+    (see Prototype)
     """
 
-    skeywords = PickleType()
-    pkeywords = PickleType()
+    skeywords = InheritablePickleType()
+    pkeywords = InheritablePickleType()
+    prototype = Reference()
 
     def __init__ (self):
         Persistent.__init__(self)
@@ -63,16 +66,56 @@ class Addressable (Persistent):
         if keyword in self.pkeywords:
             return 2
         return 0
+    
+    
+    def getQuantity (self):
+        return 1
+    
+    quantity = property(fget = getQuantity, \
+                        doc  = "Number of things this object stands for")
+    
+    
+    def portion (self, amount):
+        """ 
+        Returns a part of this thing, that stands for amount
+        things, without changing it. Addressables are indivisible
+        by default, so this returns self (see StackableItem)
+        """
+        return self
+
+
+def parseQuantity (keyword):
+    """
+    Splits a leading number from keyword.
+    "3 coins" gives (3, "coins"), "coins" gives (None, "coins").
+    Keywords, that aren't strings (like exits), have no number
+    
+    @rtype: tuple<int,str>
+    """
+    if not isinstance(keyword, basestring):
+        return (None, keyword)
+    parts = keyword.split(None, 1)
+    if len(parts) == 2 and parts[0].isdigit():
+        return (int(parts[0]), parts[1])
+    return (None, keyword)
 
 
 def callAdressables (keyword, collection):
     """ 
     Gets all items in collection, that respond to keyword. Returns
-    only a one-item list, if keyword was singular
+    only a one-item list, if keyword was singular. A leading number
+    (like "3 coins") limits the quantity of things found. Parts of
+    stacks are returned as portions, they are split only by actions,
+    that move, use or consume them (see StackPortion).
         
     @param collection: list of addressable things
     @rtype: list<Addressable>
     """
+    amount, keyword = parseQuantity(keyword)
+    
+    if amount is not None and amount < 1:
+        return []
+    
     found = []
     for thing in collection:        
         # forward call
@@ -82,15 +125,26 @@ def callAdressables (keyword, collection):
         # 1 means: thing found and it was a singular noun
             
         if response == 1:
-            found.append(thing)
+            found.append(thing.portion(amount or 1))
             # break - no further stuff was mentioned
             break
             
         # 2 means: thing found and it was a plural noun
-        elif response == 2:    
-            found.append(thing)
-            # --- no break here --- just proceed and look 
-            # if anything else responds
+        elif response == 2:
+            
+            if amount is None:
+                found.append(thing)
+                # --- no break here --- just proceed and look 
+                # if anything else responds
+                continue
+            
+            # a quantity was mentioned: take as much
+            # as needed and stop if there is enough
+            part = thing.portion(amount)
+            found.append(part)
+            amount -= part.quantity
+            if amount <= 0:
+                break
                 
     return found
 
@@ -105,14 +159,15 @@ class Perceivable (Addressable):
     @since: 0.1
     
     Implements player actions for visual nature,
-    smell, surface feeling and sound
+    smell, surface feeling and sound. Empty descriptions
+    fall through to the prototype (see Prototype)
     """
     
-    shortdescription = String()
-    longdescription  = String()
-    odor             = String()
-    feeling          = String()
-    sound            = String()
+    shortdescription = InheritableString()
+    longdescription  = InheritableString()
+    odor             = InheritableString()
+    feeling          = InheritableString()
+    sound            = InheritableString()
     
     explicit = Boolean()
     
@@ -182,6 +237,35 @@ class Perceivable (Addressable):
         raise NoSound("")
 
 
+class Prototype (Perceivable):
+    
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+    
+    Shared template for descriptions and keywords. Objects,
+    that reference a prototype, only store the fields they
+    override; empty fields are read from the prototype. Use
+    this for things, that are spawned in great numbers.
+    
+    @warning: Classes, that are instantiated from prototypes,
+    shouldn't set descriptions or keywords in __init__
+    """
+    
+    def __init__ (self):
+        Perceivable.__init__(self)
+    
+    
+    def instantiate (self, cls, *args):
+        """ Creates an instance of cls based on this prototype
+        @rtype: cls """
+        thing = cls(*args)
+        thing.prototype = self
+        return thing
+
+
 class Detail (Perceivable):
     
     """ 
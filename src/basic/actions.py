@@ -20,12 +20,14 @@
 #################################################
 
 from engine.ormapping import Store
+from engine.instrumentation import CommandStats
+from engine.census import Census
 from abstract.perception import callAdressables
 from basic.exceptions import UnknownPlayer, BadPassword
 from basic.exceptions import UnknownPlayerType, PlayerExists, NotABin
 from basic.exceptions import ImpossibleAction, UndrinkableItem
 from basic.exceptions import UnusableItem, UnwearableItem
-from basic.exceptions import UneatableItem
+from basic.exceptions import UneatableItem, NoSuchAction
 
 
 from hashlib import sha512
@@ -67,6 +69,37 @@ def logout (player, arguments):
     player.logout()
 
 
+def showCommandStats (handler, arguments):
+    """ [admin] shows the command latency report """
+    for line in CommandStats().getReport():
+        handler.receiveMessage(line)
+
+
+def profileCommands (handler, arguments):
+    """ [admin] profiles the next n commands (argument is a 
+    number) or the next command running an action (argument 
+    is the name of the action function) 
+    @raise NoSuchAction: if the handler's context has no
+    such action """
+    argument = arguments[0]
+    stats = CommandStats()
+    if argument.isdigit():
+        stats.profile(int(argument))
+    else :
+        names = [s.actionf.__name__ for s in handler.context.semantics]
+        if argument not in names:
+            raise NoSuchAction("")
+        stats.profile(1, argument)
+    handler.receiveMessage("profiling into " + stats.profiledir)
+
+
+def showCensus (handler, arguments):
+    """ [admin] shows memory usage per class and the growth
+    since the last census """
+    for line in Census().getReport():
+        handler.receiveMessage(line)
+
+
 def register (handler, arguments):
     """ starts register process """
     handler.switchToRegisterHandler()
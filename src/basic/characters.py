@@ -24,14 +24,16 @@
     (like an inventory or the ability to inflict damage)
  """
 
-from engine.ormapping import Persistent, Reference, BackRef
+from engine.ormapping import Store, Persistent, Reference, BackRef
 from engine.ormapping import Boolean, Integer, OneToOne
 from abstract.perception import Addressable, DetailedPerceivable, callAdressables
 from abstract.evolvement import GradualImprovable, Improvable
 from basic.items import ItemCollection
+from collections import OrderedDict
 from engine.user import User
 from engine.client import GameHandler
 from basic.exceptions import ImprovementNotAllowed
+from mixins.fights import FightFilter
 
 
 class BodyPart (Addressable):
@@ -162,6 +164,42 @@ class Constitution (Improvable,
         qualityChanged
         """
         self.quality = self.maxquality
+    
+    
+    @classmethod
+    def regenerateAll (cls, value):
+        """
+        Improves every constitution of this type (subtypes 
+        included) by value and writes the changes at once.
+        
+        @Warning: Doesn't call qualityMaximum or
+        qualityChanged
+        """
+        names = []
+        queue = [cls]
+        while queue:
+            c = queue.pop()
+            names.append(c.__name__)
+            queue += c.__subclasses__()
+        
+        s = Store()
+        marks = ",".join("?" * len(names))
+        idtuples = s.cursor.execute("select id from Persistent where _class in (" 
+                                    + marks + ")", names).fetchall()
+        
+        rows = []
+        for tuple in idtuples:
+            c = s.objects[tuple[0]]
+            quality = c.quality
+            maximum = c.maxquality
+            if quality < maximum:
+                nq = min(quality+value, maximum)
+                # journaled, if a unit of work is running
+                c.__remember__("_quality")
+                c.__dict__["_quality"] = nq
+                rows.append((nq, c.id))
+        
+        s.updateMany("Improvable", "_quality", rows)
         
 
 class VitalConstitution (Constitution):
@@ -204,6 +242,8 @@ class Character (DetailedPerceivable):
     
     constitution      = BackRef(Constitution,"character")
     unsortedbodyparts = BackRef(BodyPart,"character")
+    
+    __volatile__ = ("_constitutions", "_ctable")
       
     def __init__ (self):
         DetailedPerceivable.__init__(self)
@@ -257,14 +297,64 @@ class Character (DetailedPerceivable):
         return callAdressables(keyword, self.bodyparts)
     
     
-    def addConstitution (self, character):        
+    def addConstitution (self, constitution):        
         """Adds constitution to the character"""
-        character.character = self
+        constitution.character = self
+        
+        clist = self.__dict__.get("_constitutions")
+        if clist is not None:
+            clist.append(constitution)
+        
+        table = self.__dict__.get("_ctable")
+        if table is not None:
+            for ctype, typed in table.items():
+                if isinstance(constitution, ctype):
+                    typed.append(constitution)
 
 
-    def removeConstitution (self, character):
+    def removeConstitution (self, constitution):
         """Removes constitution from the Character"""
-        character.character = None
+        constitution.character = None
+        
+        clist = self.__dict__.get("_constitutions")
+        if clist is not None and constitution in clist:
+            clist.remove(constitution)
+        
+        table = self.__dict__.get("_ctable")
+        if table is not None:
+            for typed in table.values():
+                if constitution in typed:
+                    typed.remove(constitution)
+
+
+    def getConstitutions (self):
+        """ returns the volatile list of constitutions (don't 
+        alter it, use add/removeConstitution). Built on first use """
+        clist = self.__dict__.get("_constitutions")
+        if clist is None:
+            clist = self.constitution
+            self._constitutions = clist
+        return clist
+
+
+    def getConstitutionsOfType (self, ctype):
+        """
+        returns every constitution of type <ctype> from the 
+        volatile type table (don't alter the list)
+        @rtype: list<Constitution>
+        """
+        table = self.__dict__.get("_ctable")
+        if table is None:
+            table = {}
+            self._ctable = table
+        typed = table.get(ctype)
+        if typed is None:
+            typed = []
+            for constitution in self.getConstitutions():
+                if isinstance(constitution, ctype):
+                    typed.append(constitution)
+            table[ctype] = typed
+        return typed
 
              
     def getConstitutionOfType (self, ctype):
@@ -272,11 +362,9 @@ class Character (DetailedPerceivable):
         will return constitution object for type <ctype>
         @rtype: constitution or None
         """
-        clist = self.constitution
-        for constitution in clist:
-            if isinstance(constitution, ctype):
-                return constitution
-                break
+        typed = self.getConstitutionsOfType(ctype)
+        if typed:
+            return typed[0]
         return None    
 
 
@@ -289,7 +377,7 @@ class Character (DetailedPerceivable):
     def resetConstitution (self):
         """ for convenience. resets every constitution to
         its maximum """
-        for c in self.constitution :
+        for c in self.getConstitutions() :
             c.reset()
 
 
@@ -307,6 +395,49 @@ class Character (DetailedPerceivable):
         pass
     
     
+    def suspend (self):
+        """ [event method] gets invoked if the character's
+        dungeon becomes dormant. Timers should be stopped """
+        pass
+    
+    
+    def resume (self, elapsed):
+        """ [event method] gets invoked if a player approaches
+        the character's dormant dungeon. Timers should be 
+        restarted and the elapsed time (in seconds) should
+        be caught up in one step """
+        pass
+    
+    
+    def tearDown (self):
+        """ [internal] deletes the character and everything it
+        owns (inventory, body parts, constitutions, attributes,
+        details and its npc party) """
+        self.suspend()
+        
+        doomed = list(self.details)
+        doomed += self.constitution
+        doomed += self.unsortedbodyparts
+        
+        inventory = self.inventory
+        if inventory:
+            doomed += inventory.allitems
+            doomed.append(inventory)
+        
+        attributeset = self.attributeset
+        if attributeset:
+            doomed += attributeset.attributes
+            doomed.append(attributeset)
+        
+        npcparty = self.npcparty
+        if npcparty:
+            doomed.append(npcparty)
+        
+        for o in doomed:
+            o.__delete__()
+        self.__delete__()
+    
+    
         
 class CharacterCollection (object):
 
@@ -366,10 +497,110 @@ class Inventory (Persistent, ItemCollection):
     @version: 0.1
     @since: 0.1
     
-    A very simple player inventory
+    A very simple player inventory. Caches the items, that
+    are relevant in fights (see MilitantCharacter) and keeps
+    an index of ammunition (see AmmoDrivenWeapon)
     """
 
     character = OneToOne(Character,"inventory")
+    
+    __volatile__ = ("_weapons", "_fightfilters", "_ammo")
+
+    def itemsChanged (self):
+        """ [overwritten] drops the fight caches """
+        self._weapons = None
+        self._fightfilters = None
+
+
+    def getWeapons (self):
+        weapons = self.__dict__.get("_weapons")
+        if weapons is None:
+            weapons = []
+            for item in self.useditems:
+                if "inflictDamage" in dir(item):
+                    weapons.append(item)
+            self._weapons = weapons
+        return weapons
+
+    weapons = property(fget = getWeapons, \
+                       doc  = "weapons in use (don't alter the list)")
+
+
+    def getFightFilters (self):
+        filters = self.__dict__.get("_fightfilters")
+        if filters is None:
+            filters = self.getUsedItemsOfType(FightFilter)
+            self._fightfilters = filters
+        return filters
+
+    fightfilters = property(fget = getFightFilters, \
+                            doc  = "fight filters in use (don't alter the list)")
+
+
+    def getAmmoIndex (self, ammotype):
+        """ [internal] returns the volatile ammo index for ammotype
+        (container -> items). Builds it on first use """
+        index = self.__dict__.get("_ammo")
+        if index is None:
+            index = {}
+            self._ammo = index
+        if ammotype not in index:
+            containers = OrderedDict()
+            for item in self.allitems:
+                if isinstance(item, ammotype):
+                    self.indexAmmo(containers, item)
+            index[ammotype] = containers
+        return index[ammotype]
+
+
+    def indexAmmo (self, containers, item):
+        """ [internal] """
+        container = item.collection
+        if container not in containers:
+            containers[container] = OrderedDict()
+        containers[container][item] = True
+
+
+    def itemsEntered (self, items):
+        """ [overwritten] updates the ammo index """
+        index = self.__dict__.get("_ammo")
+        if not index:
+            return
+        for ammotype, containers in index.items():
+            for item in items:
+                if isinstance(item, ammotype):
+                    self.indexAmmo(containers, item)
+
+
+    def itemsLeft (self, items):
+        """ [overwritten] updates the ammo index """
+        index = self.__dict__.get("_ammo")
+        if not index:
+            return
+        for ammotype, containers in index.items():
+            for item in items:
+                ammo = containers.get(item.collection)
+                if ammo is None:
+                    continue
+                ammo.pop(item, None)
+                if not ammo:
+                    del containers[item.collection]
+
+
+    def getAmmo (self, ammotype):
+        """ 
+        returns a pair (ammo, present) with the next ammunition
+        of type ammotype and bool, if it lies in a container in
+        use. Returns (None, False), if there is no ammunition
+        """
+        first = None
+        for container, ammo in self.getAmmoIndex(ammotype).items():
+            if container is not self and container.isInUse():
+                return (next(iter(ammo)), True)
+            if first is None:
+                first = next(iter(ammo))
+        return (first, False)
+
 
     def showItems (self, actor):
         actor.receiveMessage("-"*20)
@@ -409,6 +640,30 @@ class Player (GameHandler,
         self._context = None
     
     
+    def __remember__ (self, attrname):
+        """ [overwritten] the party, that the player leaves,
+        forgets its identifier """
+        if attrname == "_party":
+            self.forgetPartyIdentifier()
+        Persistent.__remember__(self, attrname)
+    
+    
+    def __update__ (self, attrname):
+        """ [overwritten] the party, that the player joins,
+        forgets its identifier """
+        Persistent.__update__(self, attrname)
+        if attrname == "_party":
+            self.forgetPartyIdentifier()
+    
+    
+    def forgetPartyIdentifier (self):
+        """ [internal] drops the cached identifier of the
+        player's party (see Party.getIdentifier) """
+        party = self.party
+        if party is not None:
+            party.__dict__.pop("_identifier", None)
+    
+    
     def __initdefaults__ (self):
         Character.__initdefaults__(self)
         self.party = Party()
@@ -436,14 +691,16 @@ class Player (GameHandler,
         """ [registerhandler action] gets invoked, if
         player creation process is done """
         handler.client.handler = self
-        self.location = self.defaultlocation
+        if self.defaultlocation:
+            self.defaultlocation.addCharacter(self)
     
     
     def wakeup (self, handler):    
         """ [loginhandler action] gets invoked, if
         player has successfully logged in """
         handler.client.handler = self
-        self.location = self.lastlocation
+        if self.lastlocation:
+            self.lastlocation.addCharacter(self)
         self.__contextinit__()
     
     
@@ -477,6 +734,8 @@ class Party (Addressable,
     autofollow = Boolean()
     players    = BackRef(Player,'party')
     
+    __volatile__ = ("_identifier",)
+    
     def __init__ (self):
         Addressable.__init__(self)
         CharacterCollection.__init__(self)
@@ -504,10 +763,16 @@ class Party (Addressable,
     
     def getIdentifier (self):
         """ returns an identifier for quest dungeons """ 
+        # volatile, reset, whenever a player's party changes
+        # (see Player.forgetPartyIdentifier)
+        identifier = self.__dict__.get("_identifier")
+        if identifier is not None:
+            return identifier
         logins = []
         for p in self.players:
             logins.append(p.login)
         s = sorted(logins)
-        return "|".join(s)
+        self._identifier = "|".join(s)
+        return self._identifier
 
     identifier = property(getIdentifier)
@@ -15,9 +15,14 @@
 #    You should have received a copy of the GNU General Public License
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
-from engine.ormapping import Persistent, BackRef, String, Reference, Boolean
+from twisted.internet import reactor
+from engine.ormapping import Store, Persistent, BackRef, String, Reference, Boolean
 from abstract.causality import SignalListener, Signal
 from basic.rooms import Room
+from basic.characters import Player
+from basic.exceptions import DungeonUnavailable
+from engine.timers import TimerWheel
+from time import time
 
 
 class Dungeon (Persistent):
@@ -30,14 +35,30 @@ class Dungeon (Persistent):
     
     A Dungeon is a collection of rooms. For additional uses
     of dungeons, see QuestDungeon
+    
+    Dungeons are also the unit of zone activation. A dungeon
+    without players within Room.activationrange exits is
+    suspended (dormant): the characters in its rooms stop
+    ticking and catch up the elapsed time in one step, when
+    a player approaches again.
     """
 
     rooms = BackRef(Room,"dungeon")
     
+    # volatile. after a restart no player is
+    # connected, so every dungeon starts dormant
+    visitors  = 0
+    suspended = True
+    suspendedsince = None
+    
     def __init__ (self):
         Persistent.__init__(self)
     
     
+    def __postload__ (self):
+        self.suspendedsince = time()
+    
+    
     def getClone(self, identifier):
         return self
     
@@ -62,6 +83,66 @@ class Dungeon (Persistent):
                           doc="A list of all characters in this dungeon")
 
 
+    def isDormant (self):
+        return self.suspended
+    
+    dormant = property(fget=isDormant, \
+                       doc="True if no player is near the dungeon")
+    
+    
+    def addVisitor (self):
+        """ [internal] gets invoked by rooms in range, if a player
+        arrives. Resumes the dungeon, if it was dormant """
+        Store().onRollback(self.countVisitors, -1)
+        self.countVisitors(1)
+    
+    
+    def removeVisitor (self):
+        """ [internal] gets invoked by rooms in range, if a player
+        leaves. The dungeon will be suspended at the end of the 
+        current reactor iteration, if nobody came back meanwhile
+        (a player walking from room to room would otherwise
+        suspend and resume the dungeon on every step) """
+        Store().onRollback(self.countVisitors, 1)
+        self.countVisitors(-1)
+    
+    
+    def countVisitors (self, n):
+        """ [internal] adds n (maybe negative) visitors. Also
+        undoes add-/removeVisitor, if a move is rolled back """
+        self.visitors += n
+        if self.visitors and self.suspended:
+            self.resume()
+        elif not self.visitors:
+            reactor.callLater(0, self.checkDormancy)
+    
+    
+    def checkDormancy (self):
+        """ suspends the dungeon, if there are no visitors """
+        if not self.visitors and not self.suspended:
+            self.suspend()
+    
+    
+    def suspend (self):
+        """ Freezes the dungeon. Invokes suspend on every room """
+        self.suspended = True
+        self.suspendedsince = time()
+        for room in self.rooms:
+            room.suspend()
+    
+    
+    def resume (self):
+        """ Wakes the dungeon up. Invokes resume on every room
+        with the time (in seconds), the dungeon was dormant """
+        elapsed = 0
+        if self.suspendedsince:
+            elapsed = time() - self.suspendedsince
+        self.suspended = False
+        self.suspendedsince = None
+        for room in self.rooms:
+            room.resume(elapsed)
+
+
 class QuestTask (Persistent):
     
     """ 
@@ -115,12 +196,19 @@ class QuestCompletionListener (SignalListener):
     class during the game. Use the addTask method of
     the QuestDungeon instance and TaskCompletionSignals
     for this. 
+    
+    Tasks are kept in a volatile name-keyed table with a
+    counter of incomplete tasks, so a signal costs O(1)
     """    
     
     dungeon  = Reference()
     tasks    = BackRef(QuestTask,"completionlistener")
     complete = Boolean()
     
+    signaltypes = (TaskCompletionSignal,)
+    
+    __volatile__ = ("_tasktable", "_remaining")
+    
     def __init__ (self, dungeon):
         SignalListener.__init__(self)
         self.dungeon = dungeon
@@ -129,27 +217,47 @@ class QuestCompletionListener (SignalListener):
     
     def addTask (self, name):
         task = QuestTask(self, name)
+        table = self.__dict__.get("_tasktable")
+        if table is not None:
+            table.setdefault(name, []).append(task)
+            self._remaining += 1
+    
+    
+    def getTaskTable (self):
+        """ returns the volatile table name -> tasks. Built
+        on first use """
+        table = self.__dict__.get("_tasktable")
+        if table is None:
+            table = {}
+            remaining = 0
+            for task in self.tasks:
+                table.setdefault(task.name, []).append(task)
+                if not task.complete:
+                    remaining += 1
+            self._tasktable = table
+            self._remaining = remaining
+        return table
     
         
     def signalReceived (self, signal):     
-        if self.complete:
-            return
         if not isinstance(signal, TaskCompletionSignal):
             return
+        if self.complete:
+            return
         name = signal.taskname
-        for task in self.tasks:
-            if task.name == name :
+        for task in self.getTaskTable().get(name, ()):
+            if not task.complete:
                 task.complete = True
+                self._remaining -= 1
         self.checkCompletion()
          
          
     def checkCompletion (self):
         """ checks for completed tasks and invokes
         dungeons questComplete method if necessary """
-        for t in self.tasks :
-            if not t.complete:
-                return
-                break
+        self.getTaskTable()
+        if self._remaining:
+            return
         self.complete = True
         self.dungeon.questComplete()
             
@@ -165,33 +273,275 @@ class QuestDungeon (Dungeon):
     QuestDungeons clone themselves for each player party.
     This way several parties can solve a quest at the
     same time 
+    
+    Clones are looked up by (class name, identifier), first
+    in the volatile clones table, then via the index on the
+    identifier column (see createIndex)
+    
+    Clones are built by __init__ like the template dungeon.
+    Every clone room references its template room (see 
+    getInstanceRoom). The template keeps poolsize pre-warmed
+    clones, that are handed out on entry. Completed clones
+    are torn down after staying dormant for reapdelay seconds
     """    
     
     identifier = String()
     completionlistener = Reference()
+    template = Reference()
+    
+    poolsize = 0
+    """ number of pre-warmed clones """
+    
+    reapdelay = 600
+    """ seconds a completed clone may stay dormant before it
+    is torn down. None disables reaping """
+    
+    # volatile. (class name, identifier) -> clone
+    clones = {}
+    
+    # volatile. the template, that is cloned right now
+    building = None
+    
+    __volatile__ = ("_roommap", "_pool", "_ordinals")
     
     def __init__ (self):
         Dungeon.__init__(self)
         self.completionlistener = QuestCompletionListener(self)
     
     
+    def __rollback__ (self):
+        """ [overwritten] forgets clones, that were created in
+        the rolled back unit of work """
+        Dungeon.__rollback__(self)
+        if Store().objects.get(self.id) is not self:
+            for key, clone in QuestDungeon.clones.items():
+                if clone is self:
+                    del QuestDungeon.clones[key]
+    
+    
+    def __postload__ (self):
+        """ [overwritten] creates the identifier index in 
+        databases, that were created without it """
+        Dungeon.__postload__(self)
+        QuestDungeon.createIndex()
+    
+    
+    @classmethod
+    def createIndex (cls):
+        """ Creates the identifier index for getClone (if it
+        doesn't exist) """
+        s = Store()
+        s.cursor.execute("create index if not exists " +
+                         "QuestDungeon_identifier on " +
+                         "QuestDungeon (_identifier)")
+    
+    
     def getClone(self, identifier):
         """ Returns clone for identifier """
-        dungeons = self.getAllInstances()
-        for d in dungeons:
-            if d.identifier == identifier:
-                return d
+        key   = (self.__class__.__name__, identifier)
+        clone = QuestDungeon.clones.get(key)
+        if clone is not None:
+            return clone
+        
+        # every quest dungeon class may have a clone with
+        # this identifier. those are few, so filter here
+        s = Store()
+        idtuples = s.cursor.execute("select id from QuestDungeon " +
+                                    "where _identifier = ?",
+                                    (identifier,)).fetchall()
+        for tuple in idtuples:
+            d = s.objects[tuple[0]]
+            if d.__class__ is self.__class__:
+                clone = d
                 break
-        newd = self.__class__()
-        newd.identifier = identifier
-        return newd
+        else :
+            pool = self.getPool()
+            if pool:
+                clone = pool.pop()
+                Store().onRollback(pool.append, clone)
+                clone.identifier = identifier
+            else :
+                clone = self.createClone(identifier)
+            
+            # refill the pool after the party has entered
+            if self.poolsize:
+                TimerWheel().callLater(0, self.warmPool)
+        
+        QuestDungeon.clones[key] = clone
+        Store().onRollback(QuestDungeon.clones.pop, key, None)
+        return clone
+    
+    
+    def createClone (self, identifier):
+        """ [internal] builds a new clone. __init__ adds the
+        rooms of the clone in the order of the template rooms,
+        so addRoom gives the n-th room of the clone the n-th
+        room of the template as its template """
+        QuestDungeon.building = self
+        try :
+            clone = self.__class__()
+        finally :
+            QuestDungeon.building = None
+        clone.template   = self
+        clone.identifier = identifier
+        return clone
+    
+    
+    def getTemplateRoom (self, ordinal):
+        """ [internal] returns the room, that was added as
+        ordinal-th room to this template (or None) """
+        ordinals = self.__dict__.get("_ordinals")
+        if ordinals is None:
+            rooms = self.rooms
+            # templates, that were built without ordinals,
+            # get them in the order of their ids
+            if [r for r in rooms if r.ordinal is None]:
+                for i, r in enumerate(sorted(rooms, key=lambda r: r.id)):
+                    r.ordinal = i
+            ordinals = dict((r.ordinal, r) for r in rooms)
+            self._ordinals = ordinals
+        return ordinals.get(ordinal)
+    
+    
+    def getPool (self):
+        """ returns the volatile list of pre-warmed clones
+        (identifier "") """
+        pool = self.__dict__.get("_pool")
+        if pool is None:
+            pool = []
+            s = Store()
+            idtuples = s.cursor.execute("select id from QuestDungeon " +
+                                        "where _identifier = ''").fetchall()
+            for tuple in idtuples:
+                d = s.objects[tuple[0]]
+                if d.template is self:
+                    pool.append(d)
+            self._pool = pool
+        return pool
+    
+    
+    def warmPool (self):
+        """ builds clones until the pool is full """
+        pool = self.getPool()
+        while len(pool) < self.poolsize:
+            pool.append(self.createClone(""))
+    
+    
+    def getInstanceRoom (self, room):
+        """ returns the room of this clone, that was built
+        from room of the template
+        @raise DungeonUnavailable: if the clone has no such
+        room (e.g. its __init__ builds no rooms) """
+        roommap = self.__dict__.get("_roommap")
+        if roommap is None:
+            roommap = {}
+            rooms = self.rooms
+            for r in rooms:
+                if r.template:
+                    roommap[r.template] = r
+            # clones, that were built without templates, 
+            # pair their rooms in the order of the template
+            if not roommap:
+                for r, original in zip(rooms, room.dungeon.rooms):
+                    r.template = original
+                    roommap[original] = r
+            self._roommap = roommap
+        instance = roommap.get(room)
+        if instance is None:
+            raise DungeonUnavailable("")
+        return instance
+    
+    
+    def suspend (self):
+        """ [overwritten] schedules the teardown of completed
+        clones """
+        Dungeon.suspend(self)
+        if (self.template and self.reapdelay is not None and 
+            self.completionlistener.complete):
+            self._reaper = TimerWheel().schedule(self.reapdelay, self, "reap")
+    
+    
+    def resume (self):
+        """ [overwritten] cancels a scheduled teardown """
+        reaper = self.__dict__.get("_reaper")
+        if reaper and reaper.active():
+            reaper.cancel()
+        self._reaper = None
+        Dungeon.resume(self)
+    
+    
+    def reap (self):
+        """ [internal] tears the clone down, if it is still
+        dormant and empty """
+        self._reaper = None
+        if not self.dormant:
+            return
+        for c in self.characters:
+            if isinstance(c, Player):
+                return
+        if not self.evacuate():
+            return
+        self.tearDown()
+    
+    
+    def evacuate (self):
+        """ [internal] moves logged out players, whose last
+        location is a room of the clone, to their default
+        location. Returns False, if one of them has none (the
+        clone must be kept then) """
+        rooms = self.rooms
+        if not rooms:
+            return True
+        s = Store()
+        marks = ",".join("?" * len(rooms))
+        idtuples = s.cursor.execute("select id from User where " +
+                                    "_lastlocation in (" + marks + ")",
+                                    [r.id for r in rooms]).fetchall()
+        players = [s.objects[tuple[0]] for tuple in idtuples]
+        for p in players:
+            if not p.defaultlocation:
+                return False
+        for p in players:
+            p.lastlocation = p.defaultlocation
+        return True
+    
+    
+    def tearDown (self):
+        """ Deletes the clone with its rooms and their contents
+        @warning: Players have to leave before, logged out ones
+        too (see evacuate) """
+        reaper = self.__dict__.get("_reaper")
+        if reaper and reaper.active():
+            reaper.cancel()
+        
+        key = (self.__class__.__name__, self.identifier)
+        if QuestDungeon.clones.get(key) is self:
+            del QuestDungeon.clones[key]
+        
+        for room in self.rooms:
+            room.tearDown()
+        
+        listener = self.completionlistener
+        for task in listener.tasks:
+            task.__delete__()
+        listener.__delete__()
+        self.__delete__()
     
     
     def addRoom (self, room):
         """ adds room to dungeon and adds 
-        QuestCompletionListener to room"""
+        QuestCompletionListener to room. While a clone is built,
+        room gets the room of the template, that was added at
+        the same position, as its template """
+        ordinal = len(self.rooms)
+        self.__dict__.pop("_ordinals", None)
         Dungeon.addRoom(self, room)
+        room.ordinal = ordinal
         room.addListener(self.completionlistener)
+        
+        template = QuestDungeon.building
+        if template is not None and template is not self:
+            room.template = template.getTemplateRoom(ordinal)
     
     
     def addTask (self, name):
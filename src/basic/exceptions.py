@@ -71,6 +71,9 @@ class NoSuchDirection (PlayerError):
 class AmbigousDirection (PlayerError):
     pass
 
+class DungeonUnavailable (PlayerError):
+    pass
+
 class DetailNotFound (PlayerError):
     pass
 
@@ -130,4 +133,11 @@ class UnsuitableCharacter (PlayerError):
     pass
 
 class UnsuitableDetail (PlayerError):
-    pass
\ No newline at end of file
+    pass
+
+
+# administration
+#################################################
+
+class NoSuchAction (PlayerError):
+    pass
@@ -16,9 +16,9 @@
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
 from abstract.perception import DetailedPerceivable, callAdressables
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 from engine.ormapping import Reference, BackRef, PickleType
-from engine.ormapping import Boolean, Integer
+from engine.ormapping import Store, Boolean, Integer
 from mixins.misc import Groupable
 from basic.exceptions import NotABin, UnsuitableBin, ImpossibleAction
 from basic.exceptions import UneatableItem, UnwearableItem, UndrinkableItem 
@@ -57,6 +57,28 @@ class Item (DetailedPerceivable):
     location = property(getLocation)
     
     
+    def getRoot (self):
+        c = self.collection
+        while isinstance(c, Item):
+            c = c.collection
+        return c
+    
+    root = property(fget = getRoot, \
+                    doc  = "Outermost collection (room or inventory)")
+    
+    
+    def getDepth (self):
+        depth = 0
+        c = self.collection
+        while isinstance(c, Item):
+            depth += 1
+            c = c.collection
+        return depth
+    
+    depth = property(fget = getDepth, \
+                     doc  = "Number of containers between item and root")
+    
+    
     def locationChanged (self, old, new, keyword):
         """ [event method] gets invoked if item is carried
         from one room to another """
@@ -70,6 +92,13 @@ class Item (DetailedPerceivable):
         return False
 
 
+    def usageChanged (self):
+        """ [internal] must be invoked after the result of 
+        isInUse changed. Lets the collection resort the item """
+        if self.collection:
+            self.collection.sortItem(self)
+
+
     def take (self, actor):
         """ [player action] Moves item from room to inventory """
         room = actor.location
@@ -136,6 +165,161 @@ class Item (DetailedPerceivable):
         room.addItem(self)
         
 
+class StackableItem (Item, Groupable):
+
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    A stack of identical items (like coins), that is stored as
+    a single object with an amount. If only a part of a stack is
+    addressed ("take 3 coins"), callAdressables returns a
+    StackPortion, the stack is split only by an action, that
+    moves, uses or consumes the part. Stacks are merged, if they are added to a
+    collection, that already holds a stack of the same type.
+    
+    @warning: Subclasses have to be constructable without
+    arguments, because split() creates new stacks
+    """
+    
+    amount = Integer()
+    
+    portionactions = ("take", "throwAway", "giveTo", "putInto",
+                      "takeOut", "loose", "use", "putAway", "draw",
+                      "putOn", "takeOff", "eat", "drink")
+    """ methods, that move, use or consume a part of the stack
+    (see StackPortion). Add the actions of subclasses, that 
+    change the stack """
+    
+    stackattributes = ("skeywords", "pkeywords", "shortdescription",
+                       "longdescription", "odor", "feeling", "sound")
+    """ attributes, that split copies to the new part, if the
+    stack has no prototype """
+    
+    def __init__ (self):
+        Item.__init__(self)
+        self.amount = 1
+    
+    
+    def getQuantity (self):
+        return self.amount
+    
+    quantity = property(fget = getQuantity, \
+                        doc  = "Number of items in this stack")
+    
+    
+    def isStackableWith (self, other):
+        """ returns bool, if other can be merged into this stack """
+        return (type(other) is type(self) and
+                other.prototype is self.prototype)
+    
+    
+    def portion (self, amount):
+        """ Returns a StackPortion of amount items or self, if
+        amount covers the whole stack. Doesn't split the stack """
+        if amount >= self.amount:
+            return self
+        return StackPortion(self, amount)
+    
+    
+    def split (self, amount):
+        """ 
+        Splits amount items off this stack. The new stack 
+        stays in the same collection until it is moved.
+        Returns self, if amount covers the whole stack.
+        @rtype: StackableItem
+        """
+        if amount >= self.amount:
+            return self
+        
+        part = self.__class__()
+        part.prototype = self.prototype
+        if self.prototype is None:
+            for name in self.stackattributes:
+                setattr(part, name, getattr(self, name))
+        part.amount = amount
+        if self.collection:
+            self.collection.attachItem(part)
+        self.amount = self.amount - amount
+        return part
+    
+    
+    def merge (self, other):
+        """ Merges stack other into this one. other 
+        will be removed from the database """
+        self.amount = self.amount + other.amount
+        if other.collection:
+            other.collection.removeItem(other)
+        other.__delete__()
+
+
+class StackPortion (object):
+
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Volatile stand-in for amount items of a stack, that
+    callAdressables returns for "3 coins". Reading actions 
+    (examine, smell, ...) go to the stack. The portionactions
+    of the stack split the part off first and run on it. If
+    they fail, the part is merged back.
+    """
+
+    def __init__ (self, stack, amount):
+        self.stack  = stack
+        self.amount = amount
+
+
+    def getQuantity (self):
+        return self.amount
+
+    quantity = property(fget = getQuantity, \
+                        doc  = "Number of items in this portion")
+
+
+    def getClass (self):
+        return self.stack.__class__
+
+    # isinstance checks see the stack's type
+    __class__ = property(getClass)
+
+
+    def __getattr__ (self, name):
+        stack = self.stack
+        if name not in stack.portionactions:
+            return getattr(stack, name)
+
+        def action (*args, **kw):
+            part = stack.split(self.amount)
+            try :
+                return getattr(part, name)(*args, **kw)
+            except Exception:
+                # the part may have been merged somewhere else
+                if part is not stack and Store().objects.get(part.id) is part:
+                    stack.merge(part)
+                raise
+        return action
+
+
+    def __dir__ (self):
+        return dir(self.stack)
+
+
+    def __eq__ (self, other):
+        return self.stack == other
+
+    def __ne__ (self, other):
+        return self.stack != other
+
+    def __hash__ (self):
+        return hash(self.stack)
+
+
 class ItemCollection (object):
 
     """ 
@@ -146,51 +330,223 @@ class ItemCollection (object):
 
     A simple collection for items. Supports groupable items
     Volatile mixin
+    
+    Collections keep a volatile set of everything inside them
+    (recursively) and their items partitioned into unused and
+    used ones. Both are built on first use and maintained by
+    addItem, removeItem and Item.usageChanged. Don't set 
+    item.collection directly, they would get out of date.
     """
 
     unsorteditems = BackRef(Item,"collection")
+    
+    __volatile__ = ("_tree", "_partition")
 
     def addItem (self, i):
-        """ adds item to collection """
-        i.collection = self
+        """ adds item to collection. Stacks are merged into a
+        stack of the same type, if the collection holds one """
+        if isinstance(i, StackableItem):
+            
+            stack = None
+            for other in self.unsorteditems:
+                if other is i or not other.isStackableWith(i):
+                    continue
+                # gather split leftovers as well
+                if stack is None:
+                    stack = other
+                else :
+                    stack.merge(other)
+            
+            if stack is not None:
+                stack.merge(i)
+                return
+            
+        self.attachItem(i)
 
 
+    def attachItem (self, i):
+        """ [internal] adds item to collection without
+        merging stacks """
+        old = i.collection
+        if old is not None and old is not self:
+            # item was moved without removeItem (takeOut)
+            old.unregisterItem(i)
+        i.collection = self
+        self.registerItem(i)
+        
+
     def removeItem (self, i):
         """ removes item from collection """
+        self.unregisterItem(i)
         i.collection = None
 
 
+    def itemsChanged (self):
+        """ [event method] gets invoked, if an item was added,
+        removed or its usage changed """
+        pass
+
+
+    def itemsEntered (self, items):
+        """ [event method] gets invoked, if items were added to
+        the collection or one of its containers. Only fires, if
+        the item set of the collection is built (see getTree) """
+        pass
+
+
+    def itemsLeft (self, items):
+        """ [event method] gets invoked, before items are removed
+        from the collection or one of its containers. Only fires,
+        if the item set of the collection is built """
+        pass
+
+
+    def getContainers (self):
+        """ returns this collection and every collection,
+        that contains it (innermost first) """
+        containers = []
+        c = self
+        while isinstance(c, ItemCollection):
+            containers.append(c)
+            if not isinstance(c, Item):
+                break
+            c = c.collection
+        return containers
+
+
+    def getTree (self):
+        """ [internal] returns the volatile set of all items
+        in the collection (recursively). Builds it on first use """
+        tree = self.__dict__.get("_tree")
+        if tree is None:
+            tree  = OrderedDict()
+            queue = deque([self])
+            while queue:
+                current = queue.popleft()
+                for item in current.items:
+                    tree[item] = True
+                    if isinstance(item, ItemCollection):
+                        queue.append(item)
+            self._tree = tree
+        return tree
+
+
+    def getSubtree (self, i):
+        """ [internal] returns i and everything inside i """
+        subtree = [i]
+        if isinstance(i, ItemCollection):
+            subtree += i.getTree().keys()
+        return subtree
+
+
+    def getPartition (self):
+        """ [internal] returns the volatile pair (unused, used) 
+        of ordered item sets. Builds it on first use """
+        partition = self.__dict__.get("_partition")
+        if partition is None:
+            unused = OrderedDict()
+            used   = OrderedDict()
+            for uitem in self.unsorteditems :
+                if uitem.isInUse():
+                    used[uitem] = True
+                else :
+                    unused[uitem] = True
+            partition = (unused, used)
+            self._partition = partition
+        return partition
+
+
+    def sortItem (self, i):
+        """ [internal] sorts i into the used or unused
+        partition (see Item.usageChanged) """
+        self.itemsChanged()
+        
+        partition = self.__dict__.get("_partition")
+        if partition is None:
+            return
+        unused, used = partition
+        if i.isInUse():
+            unused.pop(i, None)
+            used[i] = True
+        else :
+            used.pop(i, None)
+            unused[i] = True
+
+
+    def registerItem (self, i):
+        """ [internal] adds i (and its content) to the item
+        sets of this collection and its containers """
+        self.sortItem(i)
+        
+        subtree = None
+        for c in self.getContainers():
+            tree = c.__dict__.get("_tree")
+            if tree is None:
+                continue
+            if subtree is None:
+                subtree = self.getSubtree(i)
+            for item in subtree:
+                tree[item] = True
+            c.itemsEntered(subtree)
+
+
+    def unregisterItem (self, i):
+        """ [internal] removes i (and its content) from the item
+        sets of this collection and its containers """
+        self.itemsChanged()
+        
+        partition = self.__dict__.get("_partition")
+        if partition is not None:
+            for part in partition:
+                part.pop(i, None)
+        
+        subtree = None
+        for c in self.getContainers():
+            tree = c.__dict__.get("_tree")
+            if tree is None:
+                continue
+            if subtree is None:
+                subtree = self.getSubtree(i)
+            c.itemsLeft(subtree)
+            for item in subtree:
+                tree.pop(item, None)
+
+
     def getItems (self):        
-        used = []
-        unused = []
-        for uitem in self.unsorteditems :
-            if uitem.isInUse():
-                used.append(uitem)
-            else :
-                unused.append(uitem)
-                
-        return unused + used
+        unused, used = self.getPartition()
+        return unused.keys() + used.keys()
     
     items = property(fget = getItems, \
                      doc  = "sorted items (unused first)")
 
 
+    def getUsedItems (self):
+        unused, used = self.getPartition()
+        return used.keys()
+    
+    useditems = property(fget = getUsedItems, \
+                         doc  = "items in use")
+
+
+    def getUsedItemsOfType (self, itemtype):
+        """ returns every used item of type itemtype
+        @rtype: list<Item> """
+        unused, used = self.getPartition()
+        return [i for i in used if isinstance(i, itemtype)]
+
+
     def getAllItems (self):
-        all = []
-        queue   = [self]
-        while queue :
-            current = queue.pop(0)
-            for item in current.items:
-                all.append(item)
-                if isinstance(item, ItemCollection):
-                    queue.append(item)
-        
-        return all
+        return self.getTree().keys()
 
     allitems = property(fget = getAllItems, \
                         doc  = "Searchs recursively for items in collection")
 
 
+    def containsItem (self, i):
+        """ returns bool, if i is (recursively) in the collection """
+        return i in self.getTree()
+
+
     def callItems (self, keyword):        
         """ 
         Calls every item in collection by keyword and
@@ -213,7 +569,7 @@ class ItemCollection (object):
             
             # if item is groupable ..
             if isinstance(i, Groupable) :
-                count[type(i)] += 1    
+                count[type(i)] += i.quantity
             else :
                 # .. otherwise proceed normally
                 i.showShort(actor)
@@ -246,6 +602,22 @@ class ChooseyItemCollection (ItemCollection):
         ItemCollection.addItem(self, i)
 
 
+class Container (Item, ItemCollection):
+    
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Item, that holds other items (bags, chests, ...)
+    """
+    
+    def __init__ (self):
+        Item.__init__(self)
+        ItemCollection.__init__(self)
+
+
 class ReusableItem (Item):
     
     """ 
@@ -292,6 +664,7 @@ class ReusableItem (Item):
             bp.item = self
             
         self.inuse = True
+        self.usageChanged()
 
             
     def putAway (self, actor):
@@ -309,6 +682,7 @@ class ReusableItem (Item):
                 bp.item = None
                 
         self.inuse = False
+        self.usageChanged()
 
 
     def isInUse (self):        
@@ -16,11 +16,11 @@
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from engine.ormapping import Boolean, Reference, BackRef
+from engine.ormapping import Boolean, Integer, Reference, BackRef
 from abstract.perception import Addressable, DetailedPerceivable, callAdressables
 from abstract.causality import SignalEmitter, SignalListener
 from abstract.causality import M2M_RoomEmitter, M2M_RoomListener
-from basic.characters import CharacterCollection
+from basic.characters import CharacterCollection, Player
 from basic.items import ItemCollection
 from random import choice
 from basic.exceptions import NoSuchDirection, AmbigousDirection
@@ -66,15 +66,26 @@ class Room (DetailedPerceivable,
 
     exits = BackRef(Exit,"anchor")
     dungeon = Reference()
+    template = Reference()
+    """ room of the template dungeon, if this room belongs
+    to a dungeon instance (see QuestDungeon) """
+    ordinal = Integer()
+    """ number of rooms, that were added to the quest dungeon
+    before this one (see QuestDungeon.addRoom) """
     
     emitterlinks  = BackRef (M2M_RoomEmitter, "room")
     listenerlinks = BackRef (M2M_RoomListener, "room")
     
+    activationrange = 1
+    """ Number of exits a player's presence reaches. Dungeons 
+    with no player in range are dormant """
+    
 
     def __init__(self):
         DetailedPerceivable.__init__(self)
         CharacterCollection.__init__(self)
         ItemCollection.__init__(self)
+        self.ordinal = None
     
     
     def getAll (self):
@@ -94,6 +105,75 @@ class Room (DetailedPerceivable,
     location = property(getLocation)
 
 
+    def getNeighborhood (self, radius):
+        """ returns all rooms within radius exits
+        (including this one) """
+        visited  = set([self])
+        frontier = [self]
+        for step in range(radius):
+            newfrontier = []
+            for room in frontier:
+                for exit in room.exits:
+                    neighbor = exit.direction
+                    if neighbor and neighbor not in visited:
+                        visited.add(neighbor)
+                        newfrontier.append(neighbor)
+            frontier = newfrontier
+        return list(visited)
+    
+    
+    def getNearbyDungeons (self):
+        """ returns all dungeons within activationrange """
+        dungeons = set()
+        for room in self.getNeighborhood(self.activationrange):
+            if room.dungeon:
+                dungeons.add(room.dungeon)
+        return dungeons
+    
+    
+    def isDormant (self):
+        if not self.dungeon:
+            return False
+        return self.dungeon.dormant
+    
+    dormant = property(fget = isDormant,
+                       doc  = "True if the room's dungeon is dormant")
+    
+    
+    def suspend (self):
+        """ [event method] gets invoked if the dungeon is
+        suspended. Invokes suspend on every character """
+        for c in self.characters:
+            c.suspend()
+    
+    
+    def resume (self, elapsed):
+        """ [event method] gets invoked if the dungeon is
+        resumed. Invokes resume on every character
+        @param elapsed: seconds the dungeon was dormant """
+        for c in self.characters:
+            c.resume(elapsed)
+
+
+    def tearDown (self):
+        """ [internal] deletes the room and its contents (items,
+        details, exits, non player characters and links)
+        @warning: Players have to leave before """
+        for c in self.characters:
+            if not isinstance(c, Player):
+                c.tearDown()
+        
+        doomed = self.allitems
+        doomed += self.details
+        doomed += self.exits
+        doomed += self.emitterlinks
+        doomed += self.listenerlinks
+        
+        for o in doomed:
+            o.__delete__()
+        self.__delete__()
+    
+    
     def addEmitter (self, e):
         """ Adds a static (!) SignalEmitter e to this room """
         link = M2M_RoomEmitter(self, e)
@@ -150,16 +230,29 @@ class Room (DetailedPerceivable,
     def addCharacter(self, c):
         
         """ 
-        Adds character c to the room
+        Adds character c to the room. Players wake up the
+        dungeons nearby, other characters fall asleep, if 
+        they enter a dormant room
         """
         
+        if isinstance(c, Player):
+            for dungeon in self.getNearbyDungeons():
+                dungeon.addVisitor()
+        
         CharacterCollection.addCharacter(self, c)
         c.location = self
+        
+        if not isinstance(c, Player) and self.dormant:
+            c.suspend()
 
 
     def removeCharacter(self, c):        
         """ Removes character c from the room """
         CharacterCollection.removeCharacter(self, c)
+        
+        if isinstance(c, Player):
+            for dungeon in self.getNearbyDungeons():
+                dungeon.removeVisitor()
     
 ####################       
       
@@ -231,10 +324,8 @@ class Room (DetailedPerceivable,
             clone = newplace.dungeon.getClone(partyident)
                 
             # reattach room
-            # TODO: sure backRefs are index safe ?
             if clone != newplace.dungeon :
-                rindex = newplace.dungeon.rooms.index(newplace)
-                newplace = clone.rooms[rindex]
+                newplace = clone.getInstanceRoom(newplace)
             
         self.removeCharacter(actor)
         newplace.addCharacter(actor)
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
-from twisted.internet.task import LoopingCall
+from engine.tick import PhasedCall
+from engine.ormapping import Store
 
 #    This file is part of Shmudder.
 #
@@ -17,8 +18,13 @@ from twisted.internet.task import LoopingCall
 #    You should have received a copy of the GNU General Public License
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
+try :
+    import numpy
+except ImportError:
+    numpy = None
 
-class Fights (LoopingCall):
+
+class Fights (PhasedCall):
     
     """ 
     @author: Fabian Vallon 
@@ -26,12 +32,15 @@ class Fights (LoopingCall):
     @version: 0.1
     @since: 0.1
 
-    Task for Characters vs Character Fights (based on LoopingCall).
+    Task for Characters vs Character Fights (based on LoopingCall,
+    runs in the combat phase of the TickPipeline, if it is running).
+    The fight queue is volatile, changes by a command are undone,
+    if its unit of work is rolled back (see Store.onRollback).
     """
 
     
     def __init__ (self, fighter):
-        LoopingCall.__init__(self, self.run)
+        PhasedCall.__init__(self, "combat", self.run)
         self.fighter = fighter
         self.fqueue = []    
     
@@ -44,27 +53,50 @@ class Fights (LoopingCall):
     
     
     def addEnemy (self, enemy):
+        Store().onRollback(self.restore, list(self.fqueue))
         self.fqueue.append(enemy)
     
     
     def removeEnemy (self, enemy):
+        Store().onRollback(self.restore, list(self.fqueue))
         self.fqueue.remove(enemy)
     
     
     def reset (self):
         """ Clears the fight queue and deletes the
         associated player from other fight queues """
+        Store().onRollback(self.restore, list(self.fqueue))
         for enemy in self.opponents:
             enemy.fights.removeEnemy(self.fighter)
         self.fqueue = []
     
     
+    def restore (self, fqueue):
+        """ [internal] resets the fight queue after a rollback """
+        self.fqueue = fqueue
+    
+    
     def run (self):
         """ LoopingCall method. """
         room = self.fighter.location
         if not room :
             return 
 
+        # the dungeon is frozen: stop ticking until
+        # a player approaches (see Dungeon.resume)
+        if room.dormant :
+            self.stop()
+            return
+        
+        self.fight()
+    
+    
+    def fight (self):
+        """ attacks the first opponent in the room """
+        room = self.fighter.location
+        if not room :
+            return 
+        
         q    = self.opponents[:]
         temp = []
 
@@ -82,3 +114,153 @@ class Fights (LoopingCall):
         # falsely overwrite it with our cache)
         q = list(set(q + temp).intersection(self.opponents))
         self.fqueue = q
+
+
+
+class Battle (PhasedCall):
+    
+    """ 
+    @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Batch resolver for mass combat (based on LoopingCall, runs in
+    the combat phase of the TickPipeline, if it is running). 
+    Fighters in a battle don't run their own Fights loop. Once
+    per round every fighter attacks and the suffered damage is 
+    staged instead of applied. Afterwards all hits are resolved
+    at once: linear fight filters and modifyDamage work on 
+    arrays (with NumPy, if it is installed) and every defender
+    is impaired once per constitution type.
+    
+    @note: Fight filters apply in the order of the inventory,
+    like for single hits. Only the linear filters at the end of a
+    defender's filters are resolved in bulk, the others are called
+    per hit (so put linear filters last, e.g. armour after magic).
+    Absorptions mustn't be negative.
+    """
+    
+    def __init__ (self):
+        PhasedCall.__init__(self, "combat", self.run)
+        self.fighters   = []
+        self.hits       = []
+        self.collecting = False
+    
+    
+    def addFighter (self, fighter):
+        """ takes fighter out of its own Fights loop """
+        if fighter.fights.running:
+            fighter.fights.stop()
+        fighter.battle = self
+        self.fighters.append(fighter)
+    
+    
+    def removeFighter (self, fighter):
+        """ gives fighter back its own Fights loop """
+        self.fighters.remove(fighter)
+        fighter.battle = None
+        if not fighter.fights.running:
+            fighter.fights.start(1.0)
+    
+    
+    def stageHit (self, defender, actor, value, constitutiontype):
+        """ [internal] gets invoked by sufferSimpleDamage
+        while the battle collects hits """
+        self.hits.append((defender, actor, value, constitutiontype))
+    
+    
+    def run (self):
+        """ LoopingCall method. """
+        self.collecting = True
+        try :
+            for fighter in self.fighters[:]:
+                fighter.fights.fight()
+        finally :
+            self.collecting = False
+        self.resolve()
+    
+    
+    def modifyDamage (self, hits, values):
+        """
+        Hook for game specific damage rules. Gets the staged
+        hits (defender, actor, value, constitution type) and
+        the filtered values and returns the values to apply. 
+        values is a numpy array, if NumPy is installed, 
+        otherwise a list. Returns values unchanged by default
+        """
+        return values
+    
+    
+    def resolve (self):
+        """ applies all staged hits """
+        hits = self.hits
+        self.hits = []
+        if not hits:
+            return
+        
+        values      = []
+        factors     = []
+        absorptions = []
+        chains      = {}
+        
+        for defender, actor, value, ctype in hits:
+            
+            if defender not in chains:
+                filters = list(defender.fightfilters)
+                # the trailing linear filters fold into one
+                # factor and absorption (filtering clamps at 0,
+                # that holds for the folded filter too)
+                factor     = 1.0
+                absorption = 0
+                while filters and filters[-1].linear:
+                    f = filters.pop()
+                    absorption += f.absorption * factor
+                    factor     *= f.factor
+                chains[defender] = (filters, factor, absorption)
+            
+            filters, factor, absorption = chains[defender]
+            
+            # the filters before have to be called one by one
+            for f in filters:
+                value = f.filter(defender, actor, value)
+            values.append(value)
+            factors.append(factor)
+            absorptions.append(absorption)
+        
+        # index every (defender, constitution type) pair
+        keys    = {}
+        indices = []
+        for defender, actor, value, ctype in hits:
+            key = (defender, ctype)
+            if key not in keys:
+                keys[key] = len(keys)
+            indices.append(keys[key])
+        
+        if numpy is not None:
+            values = numpy.array(values, dtype=float)
+            values = values * numpy.array(factors) - numpy.array(absorptions)
+            values = numpy.maximum(values, 0)
+            values = self.modifyDamage(hits, values)
+            totals = numpy.bincount(indices, weights=values, 
+                                    minlength=len(keys)).tolist()
+        else :
+            values = [max(v*f - a, 0) for v, f, a in 
+                      zip(values, factors, absorptions)]
+            values = self.modifyDamage(hits, values)
+            totals = [0] * len(keys)
+            for i, v in zip(indices, values):
+                totals[i] += v
+        
+        # the last attacker of a defender counts as actor
+        actors = {}
+        for defender, actor, value, ctype in hits:
+            actors[(defender, ctype)] = actor
+        
+        for key, i in keys.items():
+            damage = int(round(totals[i]))
+            if not damage:
+                continue
+            defender, ctype = key
+            for c in defender.getConstitutionsOfType(ctype):
+                c.impair(actors[key], damage)
@@ -28,6 +28,11 @@ class AmmoDrivenWeapon (Weapon):
     Base class for weapons, which need ammunition
     """
     
+    ammotype = None
+    """ Type of suitable ammunition. If set, ammunition is taken
+    from the inventory's ammo index. Otherwise the whole inventory
+    is searched with isSuitableAmmo on every shot """
+    
     def __init__ (self):
         Weapon.__init__(self)
         self.nextammo = None
@@ -39,6 +44,8 @@ class AmmoDrivenWeapon (Weapon):
 
     def isSuitableAmmo (self, ammo):
         """ should return bool, if ammo a is suitable """
+        if self.ammotype:
+            return isinstance(ammo, self.ammotype)
         clsn = self.__class__.__name__
         raise NotImplementedError(clsn+": Lack of isSuitableAmmo method")
 
@@ -55,31 +62,45 @@ class AmmoDrivenWeapon (Weapon):
         pass
 
 
+    def findAmmo (self, actor):
+        """
+        returns a pair (ammo, present) with the next ammunition
+        in actor's inventory and bool, if it lies in a container
+        in use (like a quiver). Returns (None, False), if there
+        is no ammunition
+        """
+        inv = actor.inventory
+        
+        if self.ammotype:
+            return inv.getAmmo(self.ammotype)
+        
+        ammo = filter(self.isSuitableAmmo, inv.allitems)
+        
+        if not ammo:
+            return (None, False)
+        
+        for a in ammo :
+            if a.collection is not inv and \
+               a.collection.isInUse():    
+                return (a, True)
+        
+        return (ammo[0], False)
+
+
     def inflictDamage(self, actor, opponent):
 
         if not self.nextammo:
 
-            inv   = actor.inventory
-            items = inv.allitems        
-            
-            ammo  = filter(self.isSuitableAmmo, items)
+            ammo, present = self.findAmmo(actor)
             
             if not ammo:
                 self.outOfAmmo(actor)
                 return
-    
-            present = []                
-            for a in ammo :
-                if a.collection is not inv and \
-                   a.collection.isInUse():    
-                    present.append(a)
             
             if not present:
                 self.ammoNotPresent(actor)
-                self.nextammo = ammo[0]
+                self.nextammo = ammo
                 return
-        
-            ammo = ammo[0]
             
         else :
             
@@ -0,0 +1,23 @@
+#    This package is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+""" @author: Fabian Vallon 
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+        
+    This package includes benchmarks for the engine. Run them
+    from the source directory, e.g. python -m benchmarks.combat
+ """
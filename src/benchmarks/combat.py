@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+""" 
+Combat microbenchmark. Two armies fight in one room, every
+fighter carries a weapon, a shield and some luggage. Compares
+the cached weapon/filter lookup of the inventory with the 
+former inventory scans and times complete hits.
+
+Usage: python -m benchmarks.combat [fighters per side] [rounds]
+"""
+
+import sys
+from time import time
+
+from engine.ormapping import Store
+from engine.dbinit import createBaseTables
+from basic.characters import Character, VitalConstitution
+from basic.items import Item, Weapon, Clothing
+from basic.rooms import Room
+from mixins.characters import MilitantCharacter
+from mixins.fights import FightFilter
+
+
+class Health (VitalConstitution):
+    pass
+
+
+class Sword (Weapon):
+    
+    def inflictDamage (self, actor, opponent):
+        opponent.sufferSimpleDamage(actor, 1, Health)
+
+
+class Shield (Clothing, FightFilter):
+    
+    def filter (self, character, actor, value):
+        return value
+
+
+class Fighter (MilitantCharacter, Character):
+    
+    def __init__ (self):
+        Character.__init__(self)
+        MilitantCharacter.__init__(self)
+        self.__initdefaults__()
+        
+        health = Health()
+        health.maxquality = 10**9
+        health.reset()
+        self.addConstitution(health)
+    
+    
+    def inflictDefaultDamage (self, opponent):
+        opponent.sufferSimpleDamage(self, 1, Health)
+
+
+def scanLookup (fighter, opponent):
+    """ the inventory scans, that were used before the caches """
+    weapons = []
+    for item in fighter.inventory.items:
+        if "inflictDamage" in dir(item) and item.isInUse():
+            weapons.append(item)
+    filters = []
+    for item in opponent.inventory.items:
+        if isinstance(item, FightFilter) and item.inuse:
+            filters.append(item)
+    return weapons, filters
+
+
+def cachedLookup (fighter, opponent):
+    return fighter.inventory.weapons, opponent.fightfilters
+
+
+def hit (fighter, opponent):
+    fighter.inflictDamage(opponent)
+
+
+def createArmy (room, size, luggage):
+    army = []
+    for n in range(size):
+        f = Fighter()
+        room.addCharacter(f)
+        
+        for thing in (Sword(), Shield()):
+            f.inventory.addItem(thing)
+            thing.use(f)
+        
+        for l in range(luggage):
+            f.inventory.addItem(Item())
+        
+        # the reactor doesn't run: stop the fight loop 
+        f.fights.stop()
+        army.append(f)
+    return army
+
+
+def measure (f, pairs, rounds):
+    start = time()
+    for r in range(rounds):
+        for fighter, opponent in pairs:
+            f(fighter, opponent)
+    return time() - start
+
+
+def run (size, rounds, luggage=20):
+    """ returns a dict of timings (in seconds) for the former
+    inventory scans, the cached lookups and complete hits """
+    Store(":memory:")
+    createBaseTables()
+    
+    room = Room()
+    red  = createArmy(room, size, luggage)
+    blue = createArmy(room, size, luggage)
+    pairs = zip(red, blue) + zip(blue, red)
+    
+    results = {}
+    results["scan"]   = measure(scanLookup, pairs, rounds)
+    results["cached"] = measure(cachedLookup, pairs, rounds)
+    results["hit"]    = measure(hit, pairs, rounds)
+    return results
+
+
+if __name__ == "__main__":
+    
+    size   = 50
+    rounds = 10
+    
+    if len(sys.argv) > 1:
+        size = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+    
+    results = run(size, rounds)
+    hits = 2 * size * rounds
+    
+    for name in ("scan", "cached", "hit"):
+        seconds = results[name]
+        print "%-8s %8.3f s  %8.1f us/hit" % (name, seconds, seconds/hits*10**6)
+    
+    print "lookup speedup %.1fx" % (results["scan"]/results["cached"])
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark suite for the engine hot paths. Every benchmark runs
+against a generated world and reports the best time per
+operation (in seconds) out of several repeats. Results are
+written as JSON and can be compared against a baseline file;
+the exit status is 1, if a benchmark got slower than the
+tolerance allows.
+
+Usage: python -m benchmarks.suite [-o results.json]
+       [-b baseline.json] [-t tolerance] [-r repeats]
+"""
+
+import os
+import sys
+import json
+import tempfile
+import optparse
+from time import time
+
+from engine.ormapping import Store
+from abstract.perception import Detail, callAdressables
+from abstract.causality import SignalEmitter, SignalListener, Signal
+from abstract.evolvement import Improvable
+from basic.rooms import Room
+from basic.exceptions import UnknownAction
+from language.german import BasicContext
+from benchmarks.combat import createArmy
+from tools.worldgen import generate, getScope
+
+
+class Viewer (object):
+
+    """ swallows the messages of Room.showLong """
+
+    def receiveMessage (self, message):
+        pass
+
+
+class Counter (SignalListener):
+
+    def signalReceived (self, signal):
+        pass
+
+
+def measure (f, n, repeats):
+    """ returns the best time per call of f out of repeats
+    runs of n calls """
+    best = None
+    for r in range(repeats):
+        start = time()
+        for i in xrange(n):
+            f()
+        t = (time() - start) / n
+        if best is None or t < best:
+            best = t
+    return best
+
+
+def closeStore ():
+    """ closes the connection of the store, before the next
+    Store(path) replaces it """
+    Store().connection.close()
+
+
+def benchLoad (results, repeats, sizes=(100, 1000)):
+    """ Store.load of a generated world with size rooms """
+    for size in sizes:
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try :
+            generate(path, rooms=size)
+            closeStore()
+
+            def load():
+                s = Store(path)
+                try :
+                    s.load(getScope())
+                finally :
+                    s.connection.close()
+            results["store.load.%d" % size] = measure(load, 1, repeats)
+        finally :
+            os.remove(path)
+
+
+def benchWorld (results, repeats):
+    """ the hot paths in a generated world """
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try :
+        generate(path, rooms=100, items=5, details=3)
+        closeStore()
+        s = Store(path)
+        s.load(getScope())
+        benchRooms(results, repeats)
+    finally :
+        closeStore()
+        os.remove(path)
+
+
+def benchRooms (results, repeats):
+    """ [internal] benchmarks of benchWorld in the loaded
+    world """
+    s = Store()
+    idtuples = s.cursor.execute("select id from Persistent where " +
+                                "_class = 'Room' order by id").fetchall()
+    # the first room with items, details and exits
+    for tuple in idtuples:
+        room = s.objects[tuple[0]]
+        if room.items and room.details and room.exits:
+            break
+    item = room.items[0]
+
+    improvable = Improvable()
+    improvable.maxquality = 100
+
+    results["orm.get.reference"] = measure(lambda: item.collection, 10000, repeats)
+    results["orm.get.integer"]   = measure(lambda: improvable.quality, 10000, repeats)
+
+    def set():
+        improvable.quality = 50
+    results["orm.set.integer"]   = measure(set, 1000, repeats)
+
+    results["backref.exits"]   = measure(lambda: room.exits, 1000, repeats)
+    results["backref.details"] = measure(lambda: room.details, 1000, repeats)
+
+    # keyword lookups at growing collection sizes
+    for size in (10, 100, 1000):
+        things = []
+        for i in range(size):
+            a = Detail()
+            a.addSingularKeyword("ding%d" % i)
+            things.append(a)
+        last = "ding%d" % (size - 1)
+        results["calladressables.%d" % size] = \
+            measure(lambda: callAdressables(last, things), 100, repeats)
+
+    # command mix of the BasicContext
+    context  = BasicContext()
+    commands = ["osten", "westen", "nimm schwert", "schau", "unt wand",
+                "toete ork", "benutze schild", "inv", "n", "bla bla"]
+    def parse():
+        for c in commands:
+            try :
+                context.parse(c)
+            except UnknownAction:
+                pass
+    results["context.parse"] = measure(parse, 100, repeats) / len(commands)
+
+    viewer = Viewer()
+    results["room.showlong"] = measure(lambda: room.showLong(viewer), 100, repeats)
+
+    emitter = SignalEmitter()
+    room.addEmitter(emitter)
+    for i in range(10):
+        room.addListener(Counter())
+    signal = Signal()
+    results["signal.emit"] = measure(lambda: emitter.emit(signal), 100, repeats)
+
+    # one round of fights
+    arena = Room()
+    red   = createArmy(arena, 20, 5)
+    blue  = createArmy(arena, 20, 5)
+    for r, b in zip(red, blue):
+        r.fights.addEnemy(b)
+        b.fights.addEnemy(r)
+    fighters = red + blue
+    def round():
+        for f in fighters:
+            f.fights.run()
+    results["fights.round"] = measure(round, 10, repeats)
+
+
+def run (repeats=3):
+    """ runs all benchmarks, returns a dict name -> seconds """
+    results = {}
+    benchLoad(results, repeats)
+    benchWorld(results, repeats)
+    return results
+
+
+def compare (results, baseline, tolerance):
+    """ returns a list of (name, seconds, baseline seconds,
+    ratio, regressed) tuples """
+    rows = []
+    for name in sorted(results):
+        t = results[name]
+        b = baseline.get(name)
+        if not b:
+            rows.append((name, t, None, None, False))
+            continue
+        ratio = t / b
+        rows.append((name, t, b, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(usage="python -m benchmarks.suite [options]")
+    parser.add_option("-o", dest="output", help="write results to this file")
+    parser.add_option("-b", dest="baseline", help="compare with this file")
+    parser.add_option("-t", dest="tolerance", type="float", default=0.2,
+                      help="allowed slowdown (default 0.2 = 20%)")
+    parser.add_option("-r", dest="repeats", type="int", default=3)
+    options, args = parser.parse_args()
+
+    results = run(options.repeats)
+
+    if options.output:
+        f = open(options.output, "w")
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+
+    baseline = {}
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+
+    regressed = False
+    for name, t, b, ratio, slower in compare(results, baseline, options.tolerance):
+        line = "%-24s %12.2f us" % (name, t * 10**6)
+        if ratio is not None:
+            line += "  %6.2fx" % ratio
+            if slower:
+                line += "  REGRESSION"
+                regressed = True
+        print line
+
+    if regressed:
+        sys.exit(1)
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from engine.ormapping import Store
+from time import time
+from sys import getsizeof
+import heapq
+import json
+
+
+def sizeOf (o):
+    """ approximate bytes retained by the persistent object o:
+    the object, its __dict__ and the dict values. Containers in
+    the dict (volatile caches and decoded values) are counted
+    with their elements, but not deeper """
+    d = o.__dict__
+    size = getsizeof(o) + getsizeof(d)
+    for key, value in d.items():
+        size += getsizeof(key) + getsizeof(value)
+        if isinstance(value, dict):
+            for k, v in value.items():
+                size += getsizeof(k) + getsizeof(v)
+        elif isinstance(value, (list, tuple, set)):
+            for v in value:
+                size += getsizeof(v)
+    return size
+
+
+class Census (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Counts the objects of the store per class: instances,
+    approximate bytes (see sizeOf), the biggest instances and
+    the growth since the last snapshot. One pass over the
+    store per snapshot. Like Store, all instances share their
+    state.
+    """
+
+    __shared_state = {}
+
+    biggest = 5
+    """ number of biggest instances kept per class """
+
+    def __init__ (self):
+        self.__dict__ = Census.__shared_state
+        if not self.__dict__:
+            self.last = None
+
+
+    def take (self):
+        """ takes a snapshot and returns it as dict class name ->
+        {count, bytes, biggest [(bytes, id)], growth, bytesgrowth} """
+        classes = {}
+        for o in Store().objects.values():
+            if o is None:
+                continue
+            name = o.__class__.__name__
+            entry = classes.get(name)
+            if entry is None:
+                entry = {"count" : 0, "bytes" : 0, "biggest" : []}
+                classes[name] = entry
+            size = sizeOf(o)
+            entry["count"] += 1
+            entry["bytes"] += size
+            if len(entry["biggest"]) < self.biggest:
+                heapq.heappush(entry["biggest"], (size, o.id))
+            else :
+                heapq.heappushpop(entry["biggest"], (size, o.id))
+
+        last = self.last or {"classes" : {}}
+        for name, entry in classes.items():
+            entry["biggest"].sort(reverse=True)
+            old = last["classes"].get(name, {"count" : 0, "bytes" : 0})
+            entry["growth"]      = entry["count"] - old["count"]
+            entry["bytesgrowth"] = entry["bytes"] - old["bytes"]
+
+        # classes, that vanished since the last snapshot
+        for name, old in last["classes"].items():
+            if name not in classes:
+                classes[name] = {"count" : 0, "bytes" : 0, "biggest" : [],
+                                 "growth" : -old["count"],
+                                 "bytesgrowth" : -old["bytes"]}
+
+        self.last = {"time" : time(), "classes" : classes}
+        return classes
+
+
+    def export (self, path):
+        """ writes the last snapshot (takes one, if there is
+        none) as JSON to path """
+        if self.last is None:
+            self.take()
+        f = open(path, "w")
+        try :
+            json.dump(self.last, f, indent=1, sort_keys=True)
+        finally :
+            f.close()
+
+
+    def getReport (self, limit=20):
+        """ takes a snapshot and returns a list of lines for the
+        limit classes using the most memory """
+        classes = self.take()
+        rows = sorted(classes.items(), key=lambda i: i[1]["bytes"],
+                      reverse=True)
+        lines = []
+        for name, e in rows[:limit]:
+            biggest = ", ".join("#%d (%d)" % (id, size)
+                                for size, id in e["biggest"][:3])
+            lines.append("%s: %d objects (%+d), %d bytes (%+d), biggest %s" %
+                         (name, e["count"], e["growth"], e["bytes"],
+                          e["bytesgrowth"], biggest))
+        return lines
@@ -2,8 +2,14 @@
 
 from twisted.protocols.basic import LineReceiver
 from twisted.internet.protocol import ServerFactory
+from twisted.python import log
 
 from abstract.exceptions import ContextError
+from engine.ormapping import Store
+from engine.tick import TickPipeline
+from engine.instrumentation import CommandStats
+from engine.recorder import SessionRecorder
+from engine.writer import barrier
 
 #    This file is part of Shmudder.
 #
@@ -34,6 +40,10 @@ class ShmudderProtocol(LineReceiver,object):
     
     Game designer must set class vars loginhandler and registerhandler 
     to suitable types
+    
+    While the TickPipeline runs, lines and output are queued and
+    processed in the pipeline phases. Input is recorded, while the
+    SessionRecorder records
     """
     
     loginhandler    = None
@@ -41,6 +51,7 @@ class ShmudderProtocol(LineReceiver,object):
     
     def __init__(self):
         self._handler = None
+        self._output  = []
 
 
     def setHandler(self, h):
@@ -58,8 +69,21 @@ class ShmudderProtocol(LineReceiver,object):
     
     def send (self,data):        
         """ Sends data back to the client """
+        pipeline = TickPipeline()
+        if pipeline.running:
+            self._output.append(data+"\r\n")
+            pipeline.queueOutput(self)
+            return
         self.transport.write(data+"\r\n")
 
+
+    def flush (self):
+        """ Sends the queued output """
+        output = self._output
+        self._output = []
+        if output:
+            self.transport.write("".join(output))
+
     
     def connectionMade(self):
         """ 
@@ -69,6 +93,10 @@ class ShmudderProtocol(LineReceiver,object):
         # shake hands
         self.factory.clients.append(self)
         
+        recorder = SessionRecorder()
+        if recorder.recording:
+            recorder.opened(self)
+        
         # initialize login handler
         lh = self.__class__.loginhandler()
         self.handler = lh
@@ -79,21 +107,49 @@ class ShmudderProtocol(LineReceiver,object):
         # strip newlines and stuff
         data = data.rstrip()
         
-        # let the handler handle it
+        recorder = SessionRecorder()
+        if recorder.recording:
+            recorder.lineReceived(self, data)
+        
+        pipeline = TickPipeline()
+        if pipeline.running:
+            pipeline.queueCommand(self, data)
+            return
+        
+        self.handleLine(data)
+    
+    
+    def handleLine (self, data):
+        """ lets the current handler handle data """
         handler = self.handler
         handler.handle(data)
         
         
     def connectionLost(self, reason):
-        """ Will be called, when client disconnects """
+        """ Will be called, when client disconnects. Returns a
+        Deferred, that fires, when the state of the logout is
+        on disk (see engine.writer.barrier) """
         self.factory.clients.remove(self)
+        TickPipeline().dropClient(self)
+        
+        recorder = SessionRecorder()
+        if recorder.recording:
+            recorder.closed(self)
 
         # TODO: still a bit dirty. maybe set location
         # and lastlocation at the same time in addChar, etc ?        
-        # save last location
+        # save last location (removeCharacter lets the
+        # room know, that a player has gone)
         if "location" in dir(self.handler):
-            self.handler.lastlocation = self.handler.location
-            self.handler.location = None
+            location = self.handler.location
+            self.handler.lastlocation = location
+            if location:
+                location.removeCharacter(self.handler)
+
+        # logout is a durability barrier
+        d = barrier()
+        d.addErrback(log.err, "state of a logout is not on disk")
+        return d
 
 
 class ShmudderFactory(ServerFactory):
@@ -147,17 +203,41 @@ class GameHandler (object):
         Handles a command by the currently active context. 
         In particular, parses the raw string into an action 
         object and handles game exceptions (e.g. if an item 
-        was not found)
+        was not found). Every command is a unit of work of the
+        store: its changes are rolled back, if it fails (volatile
+        state too, see Store.onRollback). Latency
+        and errors (including server side errors) are recorded
+        per action (see CommandStats)
         """
+        stats  = CommandStats()
+        action = "parse"
+        stats.begin(self, command)
+        store  = Store()
+        store.begin()
+
         # try to do the action
         try:
-            # get the current context and parse command
-            actionf, cargs = self.context.parse(command)
-            actionf(self, cargs)
-        except ContextError as ce :
-            # action is not possible for some reason:
-            # handle the exception
-            self.context.handle(self,ce)
+            try:
+                # get the current context and parse command
+                actionf, cargs = self.context.parse(command)
+                action = actionf.__name__
+                stats.runAction(actionf, self, cargs)
+            except ContextError as ce :
+                # action is not possible for some reason: undo
+                # its changes and handle the exception
+                store.rollback()
+                stats.recordError(action, ce)
+                self.context.handle(self,ce)
+            except Exception as e :
+                # server side error: undo, count and pass it on
+                store.rollback()
+                stats.recordError(action, e)
+                raise
+            else :
+                # the pipeline commits in its persistence phase
+                store.end(commit=not TickPipeline().running)
+        finally:
+            stats.end(action)
             
 
     def receiveMessage (self, message):
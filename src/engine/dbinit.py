@@ -33,6 +33,7 @@ def createBaseTables ():
     Perceivable.createTable()
     Improvable.createTable()
     GradualImprovable.createTable()
+    LazyImprovable.createTable()
     
     Attribute.createTable()
     AttributeCollection.createTable()
@@ -45,6 +46,7 @@ def createBaseTables ():
     Detail.createTable()
     
     Item.createTable()
+    StackableItem.createTable()
     ReusableItem.createTable()
     
     Exit.createTable()
@@ -52,6 +54,7 @@ def createBaseTables ():
     UniqueRoom.createTable()
     Dungeon.createTable()
     QuestDungeon.createTable()
+    QuestDungeon.createIndex()
     QuestTask.createTable()
     QuestCompletionListener.createTable()
     
@@ -63,4 +66,5 @@ def createBaseTables ():
     
     #Communicator.createTable()
     User.createTable()
+    Timer.createTable()
     
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from math import log
+from time import time
+import cProfile
+import os
+
+
+class Histogram (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Latency histogram with logarithmic buckets. Adding a value
+    is O(1), percentiles are accurate to one bucket (growth)
+    """
+
+    base    = 0.00001
+    """ upper bound of the first bucket (seconds) """
+
+    growth  = 1.2
+    buckets = 100
+
+    def __init__ (self):
+        self.counts = [0] * (self.buckets + 1)
+        self.count  = 0
+        self.total  = 0.0
+        self.max    = 0.0
+
+
+    def add (self, value):
+        i = 0
+        if value > self.base:
+            i = int(log(value / self.base) / log(self.growth)) + 1
+            i = min(i, self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+
+    def getPercentile (self, p):
+        """ returns the upper bound of the bucket, that contains
+        the p-th percentile (but not more than the maximum) """
+        if not self.count:
+            return 0.0
+        target = p / 100.0 * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            cumulative += n
+            if cumulative >= target:
+                break
+        return min(self.base * self.growth ** i, self.max)
+
+
+    def getMean (self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    mean = property(fget = getMean)
+
+
+class CommandStats (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Instrumentation of GameHandler.handle. Records a latency
+    histogram per action function (by name, "parse" for
+    commands, that couldn't be parsed) and counts ContextErrors
+    and unhandled exceptions per action and type. Keeps the
+    command, that is currently handled, and its handler.
+
+    The profiler can be armed to run the next commands (of one
+    action, if given) in cProfile. The result is written to
+    profiledir, when they are done.
+
+    Like Store, all instances share their state.
+    """
+
+    __shared_state = {}
+
+    profiledir = "profiles"
+
+    def __init__ (self):
+        self.__dict__ = CommandStats.__shared_state
+        if not self.__dict__:
+            self.histograms  = {}
+            self.errors      = {}
+            self.running     = []
+            self.profiling   = None
+            self.profiler    = None
+            self.lastprofile = None
+
+
+    def reset (self):
+        self.histograms = {}
+        self.errors     = {}
+
+
+    def getCurrent (self):
+        """ returns (command, handler, start time) of the command
+        in progress or None. Called by the watchdog thread too,
+        so the reactor may pop the entry meanwhile """
+        try :
+            return self.running[-1]
+        except IndexError:
+            return None
+
+    current = property(fget = getCurrent, \
+                       doc  = "Command in progress")
+
+
+    def begin (self, handler, command):
+        """ [internal] gets invoked, when handling starts """
+        self.running.append((command, handler, time()))
+
+
+    def end (self, action):
+        """ [internal] gets invoked, when handling is done """
+        command, handler, start = self.running.pop()
+        histogram = self.histograms.get(action)
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[action] = histogram
+        histogram.add(time() - start)
+
+
+    def recordError (self, action, error):
+        """ [internal] counts a ContextError or exception """
+        key = (action, type(error).__name__)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+    def profile (self, commands=1, action=None):
+        """ profiles the next commands commands. If action (name
+        of an action function) is given, only commands, that run
+        this action, are counted """
+        self.profiling = {"remaining" : commands,
+                          "action"    : action}
+        self.profiler  = cProfile.Profile()
+
+
+    def runAction (self, actionf, handler, cargs):
+        """ [internal] runs the action (in the profiler, if
+        it is armed) """
+        profiling = self.profiling
+        if (not profiling or profiling["action"] not in
+            (None, actionf.__name__)):
+            return actionf(handler, cargs)
+
+        try :
+            return self.profiler.runcall(actionf, handler, cargs)
+        finally :
+            profiling["remaining"] -= 1
+            if profiling["remaining"] <= 0:
+                self.dumpProfile()
+
+
+    def dumpProfile (self):
+        """ stops the profiler and writes the stats. Returns
+        the file name """
+        profiling = self.profiling
+        profiler  = self.profiler
+        self.profiling = None
+        self.profiler  = None
+        if profiler is None:
+            return None
+
+        if not os.path.isdir(self.profiledir):
+            os.makedirs(self.profiledir)
+        name = "%s-%d.prof" % (profiling["action"] or "commands", time())
+        path = os.path.join(self.profiledir, name)
+        profiler.dump_stats(path)
+        self.lastprofile = path
+        return path
+
+
+    def getReport (self):
+        """ returns a list of lines (one per action, slowest p99
+        first, and one per error type) """
+        rows = []
+        for action, h in self.histograms.items():
+            rows.append((h.getPercentile(99), action, h))
+        rows.sort(reverse=True)
+
+        lines = []
+        for p99, action, h in rows:
+            lines.append("%s: n=%d p50=%.1fms p95=%.1fms p99=%.1fms max=%.1fms" %
+                         (action, h.count, h.getPercentile(50) * 1000,
+                          h.getPercentile(95) * 1000, p99 * 1000,
+                          h.max * 1000))
+        for key in sorted(self.errors):
+            lines.append("%s %s: %d" % (key[0], key[1], self.errors[key]))
+        return lines
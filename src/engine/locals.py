@@ -2,6 +2,7 @@
 
 from engine.ormapping import Persistent
 from engine.user import User
+from engine.timers import Timer
 
 from abstract.causality import *
 from abstract.evolvement import *
@@ -16,7 +16,8 @@
 #    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import sqlite3, pickle
+import sqlite3, pickle, time
+from collections import OrderedDict
 
 """
 This module implements a object relational mapping suitable for multiple inheritance
@@ -81,11 +82,10 @@ class OffcutList (object):
         
         if index < self.maxfree:
             self.gaps.append(index)
-        print self.objects
         self.gaps = filter(lambda x: x < self.maxfree, self.gaps)
-        
-        s = Store()
-        s.commit()
+    
+    def get (self, i, default=None):
+        return self.objects.get(i, default)
         
     def append (self, value):
         free = self.freespot
@@ -97,19 +97,146 @@ class OffcutList (object):
         return self.objects.values()
    
         
+class Journal (object):
+    
+    """ Undo log of a unit of work (see Store.begin). Entries
+    are ("set", object, attribute, old value), ("add", object),
+    ("delete", object) and ("call", function, args) for volatile
+    state (see Store.onRollback) """
+    
+    missing = object()
+    """ old value of attributes, that weren't set before """
+    
+    def __init__ (self):
+        self.entries   = []
+        self.savepoint = False
+        self.mark      = 0
+        """ number of change sets before the savepoint """
+    
+    def remember (self, o, attrname):
+        old = o.__dict__.get(attrname, Journal.missing)
+        self.entries.append(("set", o, attrname, old))
+    
+    def getAffected (self, store):
+        """ returns the objects of the journal, the objects they
+        reference (before and after) and their containers """
+        affected = OrderedDict()
+        for entry in self.entries:
+            if entry[0] == "call":
+                continue
+            o = entry[1]
+            affected[o] = True
+            if entry[0] != "set":
+                continue
+            if not isinstance(getDescriptor(type(o), entry[2]), Reference):
+                continue
+            for id in (entry[3], o.__dict__.get(entry[2])):
+                target = store.objects.get(id)
+                if target is not None:
+                    affected[target] = True
+        
+        for o in affected.keys():
+            if not hasattr(o, "getContainers"):
+                continue
+            try :
+                containers = o.getContainers()
+            except KeyError:
+                # a reference to a deleted object
+                continue
+            for c in containers:
+                affected[c] = True
+        return affected
+    
+    def undo (self, store):
+        """ [internal] restores the objects in memory, undoes the
+        volatile changes (last first) and invokes __rollback__ on
+        the affected objects """
+        affected = self.getAffected(store)
+        calls = []
+        for entry in reversed(self.entries):
+            kind, o = entry[0], entry[1]
+            if kind == "call":
+                calls.append(entry)
+            elif kind == "set":
+                if entry[3] is Journal.missing:
+                    o.__dict__.pop(entry[2], None)
+                else :
+                    o.__dict__[entry[2]] = entry[3]
+            elif kind == "add":
+                del store.objects[o.id]
+            elif kind == "delete":
+                store.objects[o.id] = o
+        affected.update(self.getAffected(store))
+        
+        for kind, f, args in calls:
+            f(*args)
+        for o in affected:
+            o.__rollback__()
+
+
+def getDescriptor (cls, attrname):
+    """ returns the persistent descriptor of the attribute
+    attrname (e.g. "_location") of cls or None """
+    name = attrname[1:]
+    for c in cls.__mro__:
+        if name in c.__dict__:
+            return c.__dict__[name]
+    return None
+
+    
 class Store (object):
     
+    """ Transactions are explicit: writes (see execute) open one,
+    commit ends it. Units of work (see begin) are savepoints in
+    the transaction with a journal of the changed objects, so
+    they can be rolled back in memory and on disk.
+    
+    With a writer (see engine.writer.openMirror), the database
+    is an in-memory copy and the committed writing statements
+    are passed to the writer, that applies them to the file """
+    
     __shared_state = {}
     
     def __init__ (self, file=None):
         if file :
             self.__dict__   = Store.__shared_state
             self.objects    = OffcutList()
-            self.connection = sqlite3.connect(file)
+            self.connection = sqlite3.connect(file, isolation_level=None)
             self.cursor     = self.connection.cursor()
+            self.transaction   = False
+            self.units         = []
+            self.pendingcommit = False
+            self.writer        = None
+            self.changes       = []
         else :
             self.__dict__   = Store.__shared_state
     
+    def prepareWrite (self):
+        """ [internal] opens the transaction and the savepoints
+        of the units of work, if necessary """
+        if not self.transaction:
+            self.cursor.execute("begin")
+            self.transaction = True
+        for level, unit in enumerate(self.units):
+            if not unit.savepoint:
+                self.cursor.execute("savepoint unit%d" % level)
+                unit.savepoint = True
+                unit.mark = len(self.changes)
+    
+    def execute (self, statement, args=()):
+        """ executes a writing statement """
+        self.prepareWrite()
+        if self.writer:
+            self.changes.append(("execute", statement, args))
+        return self.cursor.execute(statement, args)
+    
+    def executeMany (self, statement, rows):
+        self.prepareWrite()
+        if self.writer:
+            rows = list(rows)
+            self.changes.append(("executemany", statement, rows))
+        return self.cursor.executemany(statement, rows)
+    
     def add (self,o):
         """ dumps basic data about o into the database """
         # TODO: maybe refactor this to Persitent
@@ -126,7 +253,7 @@ class Store (object):
             
             # skip, if class is not meant to be persistent
             # (could be a mixin)
-            if "__class_table__" not in dir(cls):
+            if not hasattr(cls, "__class_table__"):
                 continue
             
             # skip if class is top end of hierarchy
@@ -154,8 +281,11 @@ class Store (object):
             
             t = (o.id,o.__class__.__name__)
             
-            self.cursor.execute("insert into " + cls.__class_table__ + \
-                                " (id,_class) values (?,?)",t)
+            self.execute("insert into " + cls.__class_table__ + \
+                         " (id,_class) values (?,?)",t)
+        
+        if self.units:
+            self.units[-1].entries.append(("add", o))
         
         
     def load (self,locals):
@@ -223,10 +353,66 @@ class Store (object):
         
     def update (self, table, id, var, value):
         t = (value,id)
-        self.cursor.execute("update " + table + " set " + var + "= ? where id = ?;",t)
+        self.execute("update " + table + " set " + var + "= ? where id = ?;",t)
+
+    def updateMany (self, table, var, rows):
+        """ updates var for many objects at once. rows is a
+        list of (value, id) tuples
+        @warning: not journaled, don't use it in units of work """
+        self.executeMany("update " + table + " set " + var + "= ? where id = ?;",rows)
     
     def commit (self):
-        self.connection.commit()
+        """ commits the transaction. Inside a unit of work, the
+        commit is done, when the outermost unit ends """
+        if self.units:
+            self.pendingcommit = True
+            return
+        self.pendingcommit = False
+        if self.transaction:
+            self.cursor.execute("commit")
+            self.transaction = False
+        if self.changes:
+            self.writer.submit(self.changes)
+            self.changes = []
+    
+    def begin (self):
+        """ starts a unit of work. Units can be nested. Every
+        begin needs an end or a rollback """
+        self.units.append(Journal())
+    
+    def end (self, commit=False):
+        """ ends the current unit of work successfully. The
+        outermost unit commits, if commit is True or a commit
+        was requested during the unit """
+        unit = self.units.pop()
+        if unit.savepoint:
+            self.cursor.execute("release unit%d" % len(self.units))
+        if self.units:
+            self.units[-1].entries.extend(unit.entries)
+        elif commit or self.pendingcommit:
+            self.commit()
+    
+    def onRollback (self, f, *args):
+        """ registers f(*args) to undo a change of volatile state
+        (state, that isn't persistent), if the current unit of 
+        work is rolled back. Does nothing outside of units """
+        if self.units:
+            self.units[-1].entries.append(("call", f, args))
+    
+    def rollback (self):
+        """ rolls the current unit of work back: on disk by its
+        savepoint, in memory by its journal. Returns the number
+        of undone changes """
+        unit = self.units.pop()
+        if unit.savepoint:
+            level = len(self.units)
+            self.cursor.execute("rollback to unit%d" % level)
+            self.cursor.execute("release unit%d" % level)
+            del self.changes[unit.mark:]
+        unit.undo(self)
+        if not self.units and self.pendingcommit:
+            self.commit()
+        return len(unit.entries)
             
             
                       
@@ -245,10 +431,11 @@ class Reference (object):
 
 
     def __set__(self, instance, value):
+        instance.__remember__(self.real)
         if not value :
             instance.__dict__[self.real] = 0
         else :
-            if not "id" in dir(value):
+            if not hasattr(value, "id"):
                 raise RuntimeError("Assigned object is not persistent")
             instance.__dict__[self.real] = value.id
         instance.__update__(self.real)
@@ -262,11 +449,58 @@ class PickleType (object):
         return pickle.loads(str(instance.__dict__[self.real]))
 
     def __set__(self, instance, value):
+        instance.__remember__(self.real)
         pstring = pickle.dumps(value)
         instance.__dict__[self.real] = pstring
         instance.__update__(self.real)
     
 
+class Elapsing (PickleType):
+    
+    """ Number, that changes linearly with time (like decay or
+    regeneration) without being ticked. Saves the triple 
+    (value, rate, timestamp) and computes the current value on
+    read. Writes materialize the value and keep the rate. Use
+    Persistent.setRate to change the rate (per second) """
+    
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value, rate, since = self.getState(instance)
+        if not rate:
+            return value
+        return value + rate * (time.time() - since)
+
+    def __set__(self, instance, value):
+        rate = self.getState(instance)[1]
+        self.setState(instance, value, rate)
+    
+    def getState (self, instance):
+        pstring = instance.__dict__.get(self.real)
+        if not pstring:
+            return (0, 0, 0)
+        return pickle.loads(str(pstring))
+    
+    def setState (self, instance, value, rate):
+        PickleType.__set__(self, instance, (value, rate, time.time()))
+
+
+class InheritablePickleType (PickleType):
+    
+    """ PickleType, that falls back to the instance's prototype, 
+    if the stored value is empty. The owner class needs a 
+    prototype reference """
+    
+    def __get__(self, instance, owner):
+        pstring = instance.__dict__.get(self.real)
+        value = None
+        if pstring:
+            value = pickle.loads(str(pstring))
+        if not value and instance.prototype:
+            return getattr(instance.prototype, self.real[1:])
+        return value
+
+
 class StringList (object):
     
     def __get__(self, instance, owner):
@@ -274,6 +508,7 @@ class StringList (object):
         return strrepr.split("|")
 
     def __set__(self, instance, value):
+        instance.__remember__(self.real)
         strrep = "|".join(value)
         instance.__dict__[self.real] = strrep
         instance.__update__(self.real)
@@ -288,10 +523,26 @@ class String (object):
         return str(instance.__dict__[self.real])
 
     def __set__(self, instance, value):
+        instance.__remember__(self.real)
         instance.__dict__[self.real] = value
         instance.__update__(self.real)
 
 
+class InheritableString (String):
+    
+    """ String, that falls back to the instance's prototype, 
+    if the stored value is empty. The owner class needs a 
+    prototype reference """
+    
+    def __get__(self, instance, owner):
+        value = instance.__dict__.get(self.real)
+        if value:
+            return str(value)
+        if instance.prototype:
+            return getattr(instance.prototype, self.real[1:])
+        return ''
+
+
 class Integer (object):
 
     def __init__ (self):
@@ -301,6 +552,7 @@ class Integer (object):
         return instance.__dict__[self.real]
 
     def __set__(self, instance, value):
+        instance.__remember__(self.real)
         instance.__dict__[self.real] = value
         instance.__update__(self.real)
 
@@ -320,6 +572,7 @@ class Boolean (object):
         return False
 
     def __set__(self, instance, value):
+        instance.__remember__(self.real)
         if value :
             instance.__dict__[self.real] = 1
         else :
@@ -394,7 +647,7 @@ class Persistent (object):
     patchid = Integer()
 
     def __init__ (self):
-        if not "_instore" in dir(self):
+        if not hasattr(self, "_instore"):
             self._instore = True
             self.store = Store()
             self.store.add(self)
@@ -474,6 +727,18 @@ class Persistent (object):
         s = Store()
         s.cursor.execute("create table if not exists " + cls.__class_table__ + " " + tstr)
     
+    def getRate (self, attrname):
+        """ returns the rate of the Elapsing attribute attrname """
+        descriptor = getattr(type(self), attrname)
+        return descriptor.getState(self)[1]
+    
+    def setRate (self, attrname, rate):
+        """ sets the rate (per second) of the Elapsing attribute
+        attrname. The current value is materialized """
+        descriptor = getattr(type(self), attrname)
+        value = descriptor.__get__(self, type(self))
+        descriptor.setState(self, value, rate)
+    
     @classmethod
     def getAllInstances (cls):
         s = Store()
@@ -503,7 +768,7 @@ class Persistent (object):
             
             # skip, if class is not meant to be persistent
             # (could be a mixin)
-            if "__class_table__" not in dir(cls):
+            if not hasattr(cls, "__class_table__"):
                 continue
             
             # skip if class is top end of hierarchy
@@ -526,10 +791,32 @@ class Persistent (object):
             
             _table = cls.__class_table__
             t = (self.id,)
-            self.store.cursor.execute("delete from " + _table + " where id = ?",t)
+            self.store.execute("delete from " + _table + " where id = ?",t)
         
         del self.store.objects[self.id]
         
+        if self.store.units:
+            self.store.units[-1].entries.append(("delete", self))
+        self.store.commit()
+    
+    
+    def __remember__ (self, attrname):
+        """ [internal] journals the value of attrname, before
+        it changes in a unit of work """
+        units = self.store.units
+        if units:
+            units[-1].remember(self, attrname)
+    
+    
+    def __rollback__ (self):
+        """ [event method] gets invoked, after a unit of work,
+        that changed or referenced the object, was rolled back.
+        Drops the volatile caches named in __volatile__ of the
+        class and its bases """
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get("__volatile__", ()):
+                self.__dict__.pop(name, None)
+        
     
     def __update__ (self, attrname):
         
@@ -548,7 +835,7 @@ class Persistent (object):
             
             # skip, if class is not meant to be persistent
             # (could be a mixin)
-            if "__class_table__" not in dir(cls):
+            if not hasattr(cls, "__class_table__"):
                 continue
             
             # skip if class is top end of hierarchy
@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from engine.ormapping import Store
+from twisted.internet.defer import succeed, fail
+from time import time
+import hashlib
+import random
+import shutil
+import json
+import os
+
+
+def getStorePath ():
+    """ returns the file of the store's database """
+    for number, name, path in Store().cursor.execute("pragma database_list"):
+        if name == "main":
+            return path
+
+
+def takeSnapshot (directory):
+    """ commits the store and copies its database into
+    directory. Returns a Deferred, that fires with the snapshot
+    id (sha1 of the copy), the copy is named <id>.db. With a
+    PersistenceWriter, the writer thread copies the file, when
+    the commit is on disk """
+    s = Store()
+    s.commit()
+    if s.writer is not None:
+        return s.writer.sync(copySnapshot, s.writer.path, directory)
+    source = getStorePath()
+    if not source:
+        return fail(ValueError("a store in memory has no snapshots"))
+    return succeed(copySnapshot(source, directory))
+
+
+def copySnapshot (source, directory):
+    """ [internal] copies the database source into directory.
+    Returns the snapshot id """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temp = os.path.join(directory, "snapshot.tmp")
+    shutil.copyfile(source, temp)
+
+    snapshot = fileHash(temp)
+    os.rename(temp, os.path.join(directory, snapshot + ".db"))
+    return snapshot
+
+
+def fileHash (path):
+    sha1 = hashlib.sha1()
+    f = open(path, "rb")
+    try :
+        for block in iter(lambda: f.read(1 << 16), ""):
+            sha1.update(block)
+    finally :
+        f.close()
+    return sha1.hexdigest()
+
+
+class SessionRecorder (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Records the input of all clients for a replay (see
+    tools.replay). The recording is a file of JSON lines: a
+    header with the snapshot id of the world (see takeSnapshot)
+    and the seed of the random module, then one event per line:
+    [seconds since start, session, "open" | "line" | "close",
+    line].
+
+    The random module is seeded on start, so random decisions
+    (e.g. Room.leavePanically) repeat in the replay. Like Store,
+    all instances share their state.
+    """
+
+    __shared_state = {}
+
+    snapshotdir = "snapshots"
+
+    def __init__ (self):
+        self.__dict__ = SessionRecorder.__shared_state
+        if not self.__dict__:
+            self.recording = False
+            self.file      = None
+            self.sessions  = {}
+            self.next      = 1
+            self.start     = None
+            self.snapshot  = None
+            self.buffer    = None
+
+
+    def begin (self, path, seed=None):
+        """ takes a snapshot of the world and starts recording
+        into path. Events are buffered, until the snapshot is
+        taken (the header comes first). Returns a Deferred, that
+        fires with the snapshot id """
+        if seed is None:
+            seed = int(time())
+        random.seed(seed)
+
+        self.file   = open(path, "w")
+        self.start  = time()
+        self.buffer = []
+        self.sessions  = {}
+        self.next      = 1
+        self.recording = True
+
+        def taken (snapshot):
+            self.snapshot = snapshot
+            buffered = self.buffer
+            self.buffer = None
+            self.write({"snapshot" : snapshot, "seed" : seed,
+                        "time" : self.start})
+            for entry in buffered:
+                self.write(entry)
+            if not self.recording:
+                self.file.close()
+                self.file = None
+            return snapshot
+
+        def failed (failure):
+            self.recording = False
+            self.buffer = None
+            self.file.close()
+            self.file = None
+            return failure
+
+        return takeSnapshot(self.snapshotdir).addCallbacks(taken, failed)
+
+
+    def end (self):
+        if not self.recording:
+            return
+        self.recording = False
+        if self.buffer is None:
+            # else closed, when the snapshot is taken
+            self.file.close()
+            self.file = None
+
+
+    def write (self, entry):
+        """ [internal] """
+        if self.buffer is not None:
+            self.buffer.append(entry)
+            return
+        self.file.write(json.dumps(entry) + "\n")
+
+
+    def opened (self, client):
+        """ [internal] gets invoked, when a client connects """
+        session = self.next
+        self.next += 1
+        self.sessions[client] = session
+        self.write([time() - self.start, session, "open", None])
+
+
+    def lineReceived (self, client, line):
+        """ [internal] gets invoked for every input line """
+        session = self.sessions.get(client)
+        if session is None:
+            # connected before the recording started
+            return
+        self.write([time() - self.start, session, "line", line])
+
+
+    def closed (self, client):
+        """ [internal] gets invoked, when a client disconnects """
+        session = self.sessions.pop(client, None)
+        if session is None:
+            return
+        self.write([time() - self.start, session, "close", None])
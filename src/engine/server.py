@@ -17,6 +17,7 @@
 
 
 from twisted.internet import reactor
+from engine.tick import TickPipeline
 
 class MUDServer ():
     
@@ -34,7 +35,7 @@ class MUDServer ():
     def run (self,port):
     
         """ 
-        Starts the server    
+        Starts the server and the TickPipeline
         @param port: an integer to specify the port, the server should run on
         """ 
 
@@ -42,6 +43,10 @@ class MUDServer ():
         
         factory = self.factory
         
+        # the game loop. timers and fights, that were started
+        # on load, move into its phases
+        TickPipeline().start()
+        
         # start the reactor
         reactor.listenTCP(port, factory)
         print '\033[1;42mStatus\033[1;m Now Listening on port ' + str(port)
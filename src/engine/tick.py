@@ -0,0 +1,350 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from engine.ormapping import Store
+from twisted.internet.task import LoopingCall
+from twisted.internet import defer
+from twisted.python import log
+from collections import deque, OrderedDict
+import weakref
+from time import time
+
+
+class TickPipeline (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Central game loop. Every tick runs the phases in the order
+    given by the class var phases, each phase runs the calls
+    registered for it. Durations are recorded per phase (see
+    getStats).
+
+    While the pipeline runs, incoming lines are queued and
+    handled in the commands phase and output is sent in the
+    output phase. The commands phase stops at its budget and
+    leaves the rest for the next tick. After a tick overran
+    the interval, the deferrable phases are skipped (but at
+    most maxskips times in a row) until a tick fits again.
+
+    Like Store, all instances share their state. Set the class
+    vars before the first instantiation to configure it.
+    """
+
+    __shared_state = {}
+
+    phases = ["input", "commands", "timers", "combat", "regen",
+              "signals", "persistence", "output"]
+    """ signals is empty: the engine emits signals at once. It's
+    meant for games, that queue them """
+
+    deferrable = ["regen", "persistence"]
+    """ phases, that are skipped after an overrun """
+
+    interval = 0.1
+    """ seconds per tick """
+
+    budgets = {"commands" : 0.05}
+    """ seconds per phase. A phase exceeding its budget counts
+    as overrun """
+
+    maxskips = 10
+
+    def __init__ (self):
+        self.__dict__ = TickPipeline.__shared_state
+        if not self.__dict__:
+            self.calls    = OrderedDict((p, OrderedDict())
+                                        for p in self.phases)
+            self.stats    = {}
+            for p in self.phases:
+                self.resetPhaseStats(p)
+            self.inbox    = deque()
+            self.commands = deque()
+            self.outbox   = OrderedDict()
+            self.ticks    = 0
+            self.overruns = 0
+            self.degraded = False
+            self.skips    = dict((p, 0) for p in self.phases)
+            self.loop     = LoopingCall(self.run)
+
+            self.register("input", self.drainInput)
+            self.register("commands", self.runCommands)
+            self.register("persistence", self.flushStore)
+            self.register("output", self.flushOutput)
+
+
+    def isRunning (self):
+        return self.loop.running
+
+    running = property(fget = isRunning, \
+                       doc  = "True, if the pipeline is ticking")
+
+
+    def start (self):
+        """ starts ticking. Running PhasedCalls move into the
+        pipeline """
+        self.loop.start(self.interval, now=False)
+        for call in list(PhasedCall.calls):
+            if call.running and not call.phased:
+                call.attach()
+
+
+    def stop (self):
+        """ stops ticking. Running PhasedCalls get their own loop
+        back """
+        self.loop.stop()
+        for call in list(PhasedCall.calls):
+            if call.phased:
+                call.detach()
+                # keep the deferred of the first start
+                d = call._deferred
+                call.running = False
+                LoopingCall.start(call, call.interval, now=False)
+                call._deferred = d
+
+
+    def addPhase (self, phase, before=None):
+        """ inserts a new phase before the phase named before
+        (default: at the end) """
+        calls = self.calls.items()
+        names = [name for name, c in calls]
+        index = len(names)
+        if before is not None:
+            index = names.index(before)
+        calls.insert(index, (phase, OrderedDict()))
+        self.calls = OrderedDict(calls)
+        self.skips[phase] = 0
+        self.resetPhaseStats(phase)
+
+
+    def register (self, phase, f, interval=None, now=True):
+        """ calls f in phase every interval seconds (default:
+        every tick) """
+        every = 1
+        if interval:
+            every = max(1, int(round(interval / self.interval)))
+        self.calls[phase][f] = [every, 1 if now else every]
+
+
+    def unregister (self, phase, f):
+        self.calls[phase].pop(f, None)
+
+
+    def run (self):
+        """ LoopingCall method. Runs one tick """
+        self.ticks += 1
+        start    = time()
+        degraded = self.degraded
+
+        for phase, calls in self.calls.items():
+
+            stats = self.stats[phase]
+
+            if degraded and phase in self.deferrable:
+                if self.skips[phase] < self.maxskips:
+                    self.skips[phase] += 1
+                    stats["skipped"] += 1
+                    continue
+            self.skips[phase] = 0
+
+            t = time()
+            for f, entry in calls.items():
+                # unregistered by an earlier call
+                if f not in calls:
+                    continue
+                entry[1] -= 1
+                if entry[1] > 0:
+                    continue
+                entry[1] = entry[0]
+                try :
+                    f()
+                except Exception:
+                    log.err(None, "Error in phase " + phase)
+            duration = time() - t
+
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["last"]   = duration
+            stats["max"]    = max(stats["max"], duration)
+            budget = self.budgets.get(phase)
+            if budget and duration > budget:
+                stats["overruns"] += 1
+
+        self.degraded = time() - start > self.interval
+        if self.degraded:
+            self.overruns += 1
+
+
+    def resetPhaseStats (self, phase):
+        self.stats[phase] = {"count"    : 0,
+                             "total"    : 0.0,
+                             "last"     : 0.0,
+                             "max"      : 0.0,
+                             "overruns" : 0,
+                             "skipped"  : 0}
+
+
+    def getStats (self):
+        """ returns the phase stats (with mean duration) and the
+        tick stats as dict """
+        phases = OrderedDict()
+        for phase in self.calls:
+            stats = dict(self.stats[phase])
+            stats["mean"] = 0.0
+            if stats["count"]:
+                stats["mean"] = stats["total"] / stats["count"]
+            phases[phase] = stats
+        return {"ticks"    : self.ticks,
+                "overruns" : self.overruns,
+                "degraded" : self.degraded,
+                "queued"   : len(self.inbox) + len(self.commands),
+                "phases"   : phases}
+
+
+    def queueCommand (self, client, line):
+        """ [internal] gets invoked by ShmudderProtocol """
+        self.inbox.append((client, line))
+
+
+    def queueOutput (self, client):
+        """ [internal] gets invoked by ShmudderProtocol """
+        self.outbox[client] = None
+
+
+    def dropClient (self, client):
+        """ forgets queued commands and output of client """
+        self.inbox    = deque(c for c in self.inbox if c[0] is not client)
+        self.commands = deque(c for c in self.commands if c[0] is not client)
+        self.outbox.pop(client, None)
+
+
+    def drainInput (self):
+        """ [internal] input phase """
+        self.commands.extend(self.inbox)
+        self.inbox.clear()
+
+
+    def runCommands (self):
+        """ [internal] commands phase. Handles the queued commands
+        until the phase budget is used up """
+        commands = self.commands
+        budget   = self.budgets.get("commands")
+        start    = time()
+        while commands:
+            client, line = commands.popleft()
+            try :
+                client.handleLine(line)
+            except Exception:
+                log.err(None, "Error handling " + repr(line))
+            if budget and time() - start > budget:
+                break
+
+
+    def flushStore (self):
+        """ [internal] persistence phase """
+        s = Store()
+        if "connection" in s.__dict__:
+            s.commit()
+
+
+    def flushOutput (self):
+        """ [internal] output phase """
+        outbox = self.outbox
+        self.outbox = OrderedDict()
+        for client in outbox:
+            client.flush()
+
+
+class PhasedCall (LoopingCall):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    LoopingCall, that runs in a phase of the TickPipeline, while
+    the pipeline is running. Otherwise it behaves like a plain
+    LoopingCall. Calls, that were started before the pipeline
+    (e.g. in __postload__), move into it, when it starts, and
+    get their own loop back, when it stops.
+    """
+
+    # volatile. the running calls
+    calls = weakref.WeakSet()
+
+    def __init__ (self, phase, f, *a, **kw):
+        LoopingCall.__init__(self, f, *a, **kw)
+        self.phase  = phase
+        self.phased = False
+        """ True, while the call runs in the pipeline """
+
+
+    def start (self, interval, now=True):
+        pipeline = TickPipeline()
+        if not pipeline.running:
+            d = LoopingCall.start(self, interval, now)
+            if self.running:
+                PhasedCall.calls.add(self)
+            return d
+
+        assert not self.running, ("Tried to start an already running "
+                                  "PhasedCall.")
+        self.running  = True
+        self.interval = interval
+        self._deferred = defer.Deferred()
+        self.attach(now)
+        PhasedCall.calls.add(self)
+        return self._deferred
+
+
+    def stop (self):
+        PhasedCall.calls.discard(self)
+        if not self.phased:
+            return LoopingCall.stop(self)
+
+        # the pipeline calls, so LoopingCall.stop wouldn't
+        # fire the deferred
+        assert self.running, ("Tried to stop a PhasedCall that was "
+                              "not running.")
+        self.detach()
+        self.running = False
+        d, self._deferred = self._deferred, None
+        d.callback(self)
+
+
+    def attach (self, now=False):
+        """ [internal] moves the call into the pipeline """
+        if self.call is not None:
+            self.call.cancel()
+            self.call = None
+        TickPipeline().register(self.phase, self.runPhase, self.interval, now)
+        self.phased = True
+
+
+    def detach (self):
+        """ [internal] takes the call out of the pipeline """
+        TickPipeline().unregister(self.phase, self.runPhase)
+        self.phased = False
+
+
+    def runPhase (self):
+        """ [internal] gets invoked by the pipeline """
+        self.f(*self.a, **self.kw)
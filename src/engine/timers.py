@@ -0,0 +1,360 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from engine.ormapping import Store, Persistent, Reference, String, Integer, PickleType
+from engine.tick import PhasedCall
+from twisted.python import log
+from collections import deque
+from time import time
+
+
+class DelayedCall (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Volatile timer of the TimerWheel. Gets lost on restart, so
+    use it for things, that are rescheduled in __postload__
+    """
+
+    def __init__ (self, due, f, args, kw):
+        self.due  = due
+        self.f    = f
+        self.args = args
+        self.kw   = kw
+
+
+    def fire (self):
+        self.f(*self.args, **self.kw)
+
+
+    def cancel (self):
+        TimerWheel().cancel(self)
+
+
+    def active (self):
+        return self.__dict__.get("_slot") is not None
+
+
+class StoredReference (object):
+
+    """ [internal] stands for a persistent object in the pickled
+    arguments of a Timer """
+
+    def __init__ (self, o):
+        self.id    = o.id
+        self.classname = type(o).__name__
+
+
+class Timer (Persistent):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Persistent timer of the TimerWheel. Calls the method named
+    method of target with args, survives restarts and fires
+    late (but fires), if its time passed while the server was
+    down.
+
+    The args are pickled. Persistent objects among them are 
+    stored as references (None, if they are deleted before the
+    timer fires), everything else must be a plain value. 
+    Persistent objects inside of lists, dicts, etc. aren't
+    allowed (TypeError).
+    """
+
+    target = Reference()
+    method = String()
+    args   = PickleType()
+    duems  = Integer()
+
+    def __init__ (self, due, target, method, args):
+        # checked before the timer is stored
+        args = tuple([self.storeArgument(a) for a in args])
+        Persistent.__init__(self)
+        self.target = target
+        self.method = method
+        self.args   = args
+        self.due    = due
+
+
+    @staticmethod
+    def storeArgument (argument):
+        """ [internal] returns the picklable form of argument """
+        if isinstance(argument, Persistent):
+            return StoredReference(argument)
+        if isinstance(argument, (list, tuple, set, frozenset, dict)):
+            values = argument
+            if isinstance(argument, dict):
+                values = argument.keys() + argument.values()
+            for value in values:
+                Timer.storeArgument(value)
+                if isinstance(value, Persistent):
+                    raise TypeError("persistent objects must be timer arguments "
+                                    "of their own")
+        return argument
+
+
+    @staticmethod
+    def loadArgument (argument):
+        """ [internal] inverse of storeArgument """
+        if isinstance(argument, StoredReference):
+            o = Store().objects.get(argument.id)
+            # ids of deleted objects are handed out again
+            if type(o).__name__ != argument.classname:
+                return None
+            return o
+        return argument
+
+
+    def __postload__ (self):
+        TimerWheel().insert(self)
+
+
+    def __rollback__ (self):
+        """ [overwritten] takes timers, that were created in the
+        rolled back unit of work, out of the wheel and puts
+        cancelled ones back """
+        Persistent.__rollback__(self)
+        if Store().objects.get(self.id) is not self:
+            TimerWheel().cancel(self)
+        elif not self.active():
+            TimerWheel().insert(self)
+
+
+    def getDue (self):
+        return self.duems / 1000.0
+
+
+    def setDue (self, due):
+        self.duems = int(due * 1000)
+
+    due = property(fget = getDue, fset = setDue, \
+                   doc  = "Due time in seconds since the epoch")
+
+
+    def fire (self):
+        # deleted first: a timer with a deleted target must not
+        # fail again after every restart
+        target = self.target
+        method = self.method
+        args   = [self.loadArgument(a) for a in self.args]
+        self.__delete__()
+        getattr(target, method)(*args)
+
+
+    def cancel (self):
+        """ removes the timer. Does nothing, if it has fired """
+        TimerWheel().cancel(self)
+        if Store().objects.get(self.id) is self:
+            self.__delete__()
+
+
+    def active (self):
+        return self.__dict__.get("_slot") is not None
+
+
+class TimerWheel (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Hierarchical timing wheel for game events (respawns, effect
+    expirations, NPC actions). All timers share one LoopingCall
+    (the timers phase of the TickPipeline, if it is running)
+    instead of one reactor entry each. Scheduling and cancelling
+    are O(1), a timer is moved down at most once per level.
+
+    Level 0 has one slot per tick, every further level covers
+    slots times the range of the level below. Timers beyond the
+    range of the top level wait there for another round.
+
+    Timers are fired in scheduling order and never early. The
+    lateness of fired timers is recorded per tick, see getStats.
+    Like Store, all instances share their state. The wheel
+    starts itself on first use.
+    """
+
+    __shared_state = {}
+
+    resolution = 0.1
+    """ seconds per tick """
+
+    slots  = 256
+    levels = 4
+
+    historylength = 600
+    """ number of ticks kept for lateness stats """
+
+    def __init__ (self):
+        self.__dict__ = TimerWheel.__shared_state
+        if not self.__dict__:
+            self.wheels   = [[{} for s in range(self.slots)]
+                             for l in range(self.levels)]
+            self.epoch    = time()
+            self.current  = 0
+            self.sequence = 0
+            self.pending  = 0
+            self.fired    = 0
+            self.history  = deque(maxlen=self.historylength)
+            self.loop     = PhasedCall("timers", self.run)
+
+
+    def start (self, resolution=None):
+        """ starts ticking every resolution seconds """
+        if self.loop.running:
+            return
+        if resolution:
+            # keep the tick count of timers already inserted
+            self.epoch += self.current * (self.resolution - resolution)
+            self.resolution = resolution
+        self.loop.start(self.resolution, now=False)
+
+
+    def stop (self):
+        self.loop.stop()
+
+
+    def callLater (self, delay, f, *args, **kw):
+        """ calls f(*args, **kw) in delay seconds. Returns a
+        DelayedCall, which can be cancelled """
+        timer = DelayedCall(time() + delay, f, args, kw)
+        self.insert(timer)
+        return timer
+
+
+    def schedule (self, delay, target, method, *args):
+        """ calls the method named method of the persistent
+        object target in delay seconds, even after restart.
+        Returns a Timer, which can be cancelled """
+        timer = Timer(time() + delay, target, method, args)
+        self.insert(timer)
+        return timer
+
+
+    def insert (self, timer, earliest=None):
+        """ [internal] puts timer into its slot. It fires
+        earliest at tick earliest (default: next tick) """
+        if "_seq" not in timer.__dict__:
+            self.sequence += 1
+            timer._seq = self.sequence
+        if timer.__dict__.get("_slot") is None:
+            self.pending += 1
+
+        tick  = -int(-(timer.due - self.epoch) // self.resolution)
+        if earliest is None:
+            earliest = self.current + 1
+        tick  = max(tick, earliest)
+        delta = tick - self.current
+
+        level = 0
+        slots = self.slots
+        while level < self.levels - 1 and delta >= slots:
+            level += 1
+            slots *= self.slots
+
+        slot = self.wheels[level][(tick * self.slots // slots) % self.slots]
+        slot[timer._seq] = timer
+        timer._tick = tick
+        timer._slot = slot
+
+        if not self.loop.running:
+            self.start()
+
+
+    def cancel (self, timer):
+        """ removes timer from the wheel """
+        slot = timer.__dict__.get("_slot")
+        if slot is None:
+            return
+        del slot[timer._seq]
+        timer._slot = None
+        self.pending -= 1
+
+
+    def cascade (self, level):
+        """ [internal] moves the timers of the current slot of
+        level down to the lower levels """
+        span = self.slots ** level
+        slot = self.wheels[level][(self.current // span) % self.slots]
+        timers = slot.values()
+        slot.clear()
+        for timer in timers:
+            self.insert(timer, self.current)
+
+
+    def advance (self):
+        """ [internal] advances one tick. Returns the timers,
+        that are due """
+        self.current += 1
+
+        for level in range(self.levels - 1, 0, -1):
+            if not self.current % (self.slots ** level):
+                self.cascade(level)
+
+        slot = self.wheels[0][self.current % self.slots]
+        due  = [slot[seq] for seq in sorted(slot)]
+        slot.clear()
+        return due
+
+
+    def run (self):
+        """ LoopingCall method. Fires every timer, that is due,
+        catching up on missed ticks. Errors of timers are
+        logged """
+        target = int((time() - self.epoch) / self.resolution)
+        fired  = 0
+        late   = 0.0
+
+        while self.current < target:
+            for timer in self.advance():
+                timer._slot = None
+                self.pending -= 1
+                fired += 1
+                late = max(late, time() - timer.due)
+                try :
+                    timer.fire()
+                except Exception:
+                    # the other timers of the tick must fire
+                    log.err(None, "timer %r failed" % timer)
+
+        self.fired += fired
+        self.history.append((self.current, fired, late))
+
+
+    def getStats (self):
+        """ returns lateness stats of the recent ticks as dict """
+        history = [h for h in self.history if h[1]]
+        lateness = [h[2] for h in history]
+        stats = {"pending" : self.pending,
+                 "fired"   : self.fired,
+                 "ticks"   : self.current,
+                 "maxlateness"  : 0.0,
+                 "meanlateness" : 0.0}
+        if lateness:
+            stats["maxlateness"]  = max(lateness)
+            stats["meanlateness"] = sum(lateness) / len(lateness)
+        return stats
@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from engine.instrumentation import CommandStats
+from twisted.internet.task import LoopingCall
+from twisted.internet import reactor
+from twisted.python import log
+from time import time, ctime, sleep
+import threading
+import traceback
+import sys
+
+
+class Stall (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    A period, in which the reactor didn't complete an iteration.
+    Saves the stacks of the reactor thread, that were sampled
+    meanwhile, and the command in progress
+    """
+
+    def __init__ (self, start, command, player):
+        self.start    = start
+        self.duration = 0.0
+        self.command  = command
+        self.player   = player
+        self.stacks   = []
+
+
+    def __str__ (self):
+        lines = ["=== stall of %.3fs at %s" % (self.duration, ctime(self.start)),
+                 "command: %r by %s" % (self.command, self.player)]
+        for i, stack in enumerate(self.stacks):
+            lines.append("--- sample %d" % (i + 1))
+            lines.append(stack)
+        return "\n".join(lines)
+
+
+class Watchdog (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Notices reactor stalls. A heartbeat LoopingCall updates a
+    timestamp, a watchdog thread checks it. If the heartbeat is
+    older than threshold seconds, the stack of the reactor
+    thread is sampled (at most maxsamples times per stall)
+    together with the command in progress (see CommandStats).
+
+    Keeps the worst stalls (up to keep of them) and writes
+    them to logfile, whenever a stall ended. Like Store, all instances share
+    their state.
+    """
+
+    __shared_state = {}
+
+    threshold  = 0.5
+    heartbeat  = 0.1
+    maxsamples = 5
+    keep       = 20
+    logfile    = "stalls.log"
+
+    def __init__ (self):
+        self.__dict__ = Watchdog.__shared_state
+        if not self.__dict__:
+            self.lastbeat = time()
+            self.stall    = None
+            self.worst    = []
+            self.stalls   = 0
+            self.lock     = threading.Lock()
+            self.loop     = LoopingCall(self.beat)
+            self.thread   = None
+            self.watching = False
+            self.reactorthread = None
+
+
+    def start (self):
+        """ starts heartbeat and watchdog thread. Call this from
+        the reactor thread. Stops on reactor shutdown """
+        self.reactorthread = threading.current_thread().ident
+        self.lastbeat = time()
+        self.watching = True
+        self.loop.start(self.heartbeat)
+        self.thread = threading.Thread(target=self.watch,
+                                       name="watchdog")
+        self.thread.daemon = True
+        self.thread.start()
+        reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+
+
+    def stop (self):
+        if not self.watching:
+            return
+        self.watching = False
+        self.loop.stop()
+        self.thread.join()
+
+
+    def beat (self):
+        """ LoopingCall method. Closes the current stall """
+        now = time()
+        with self.lock:
+            stall = self.stall
+            self.stall = None
+            self.lastbeat = now
+        if stall is not None:
+            stall.duration = now - stall.start
+            self.record(stall)
+
+
+    def watch (self):
+        """ [internal] watchdog thread """
+        interval = self.threshold / 4.0
+        while self.watching:
+            sleep(interval)
+            with self.lock:
+                if time() - self.lastbeat > self.threshold:
+                    try :
+                        self.sample()
+                    except Exception:
+                        # keep watching
+                        log.err(None, "watchdog: sampling failed")
+
+
+    def sample (self):
+        """ [internal] saves the stack of the reactor thread.
+        Gets invoked by the watchdog thread """
+        stall = self.stall
+        if stall is None:
+            command = player = None
+            current = CommandStats().current
+            if current:
+                command, handler, start = current
+                player = getattr(handler, "login", None) or \
+                         type(handler).__name__
+            stall = Stall(self.lastbeat, command, player)
+            self.stall = stall
+
+        if len(stall.stacks) >= self.maxsamples:
+            return
+        frame = sys._current_frames().get(self.reactorthread)
+        if frame is not None:
+            stall.stacks.append("".join(traceback.format_stack(frame)))
+
+
+    def record (self, stall):
+        """ [internal] keeps stall, if it is one of the worst,
+        and writes the log """
+        self.stalls += 1
+        self.worst.append(stall)
+        self.worst.sort(key=lambda s: s.duration, reverse=True)
+        del self.worst[self.keep:]
+        if stall in self.worst:
+            self.writeLog()
+
+
+    def writeLog (self):
+        f = open(self.logfile, "w")
+        try :
+            for stall in self.worst:
+                f.write(str(stall) + "\n\n")
+        finally :
+            f.close()
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+from engine.ormapping import Store
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet import reactor
+from twisted.python.failure import Failure
+from twisted.python import log
+from time import time, sleep
+import threading
+import sqlite3
+import Queue
+
+
+def openMirror (path):
+    """ opens the store with an in-memory copy of the database
+    path and starts a PersistenceWriter for path. The writer
+    is closed on reactor shutdown. Returns the store
+    @warning: create the tables before, they aren't mirrored """
+    s = Store(":memory:")
+    c = s.cursor
+    c.execute("attach database ? as disk", (path,))
+    schema = c.execute("select type, name, sql from disk.sqlite_master " +
+                       "where sql is not null").fetchall()
+    for type, name, sql in schema:
+        if type == "table":
+            c.execute(sql)
+            c.execute("insert into main." + name + " select * from disk." + name)
+    # indexes after the data
+    for type, name, sql in schema:
+        if type == "index":
+            c.execute(sql)
+    c.execute("detach database disk")
+
+    writer = PersistenceWriter(path)
+    writer.start()
+    s.writer = writer
+    reactor.addSystemEventTrigger("before", "shutdown", writer.close)
+    return s
+
+
+def barrier ():
+    """ commits the store and returns a Deferred, that fires,
+    when the changes are on disk (at once without a writer)
+    @note: inside a unit of work, the commit is deferred and
+    the changes of the unit aren't covered """
+    s = Store()
+    s.commit()
+    if s.writer is None:
+        return succeed(None)
+    return s.writer.barrier()
+
+
+class PersistenceWriter (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Applies the change sets of the store (the writing statements
+    of a commit) to the database file in a thread of its own, so
+    disk writes don't stall the reactor. The queued change sets
+    are written in one transaction (up to maxbatch of them) on a
+    WAL mode connection.
+
+    If the database is locked, busy or full, the batch is retried
+    up to maxretries times, the delay doubles from retrydelay up
+    to maxdelay seconds. Other errors (e.g. a missing table, DDL
+    isn't passed to the writer) and exhausted retries drop the
+    batch. The file misses changes of the store then, so this
+    and every later barrier and sync fail (see lost).
+    """
+
+    maxbatch   = 1000
+    retrydelay = 0.1
+    maxdelay   = 5.0
+    maxretries = 10
+
+    transient = ("locked", "busy", "full")
+    """ parts of the messages of retried errors """
+
+    def __init__ (self, path):
+        self.path     = path
+        self.queue    = Queue.Queue()
+        self.thread   = None
+        self.batches  = 0
+        self.written  = 0
+        self.failures = 0
+        self.lastwrite = 0.0
+        """ seconds of the last transaction """
+        self.lost     = None
+        """ Failure of the first dropped batch """
+
+
+    def start (self):
+        self.thread = threading.Thread(target=self.run,
+                                       name="persistence writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def submit (self, changes):
+        """ queues a change set, a list of (cursor method,
+        statement, arguments) """
+        self.queue.put(("changes", changes))
+
+
+    def barrier (self):
+        """ returns a Deferred, that fires in the reactor thread,
+        when every change set submitted before is on disk. It
+        fails, if changes were lost """
+        d = Deferred()
+        self.queue.put(("barrier", d))
+        return d
+
+
+    def sync (self, f, *args):
+        """ calls f(*args) in the writer thread, when every change
+        set submitted before is on disk and the WAL is written
+        back into the database file (e.g. to copy the file).
+        Returns a Deferred, that fires in the reactor thread with
+        the result of f """
+        d = Deferred()
+        self.queue.put(("sync", (d, f, args)))
+        return d
+
+
+    def close (self):
+        """ commits the store, writes the queued change sets and
+        stops the thread. Returns a Deferred """
+        if self.thread is None:
+            return succeed(None)
+        Store().commit()
+        d = self.barrier()
+        self.queue.put(("stop", None))
+        def join (result):
+            self.thread.join()
+            self.thread = None
+            return result
+        d.addErrback(log.err, "persistence writer: changes lost")
+        return d.addBoth(join)
+
+
+    def getPending (self):
+        return self.queue.qsize()
+
+    pending = property(fget = getPending, \
+                       doc  = "Number of queued entries")
+
+
+    def run (self):
+        """ [internal] writer thread """
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        cursor = connection.cursor()
+        cursor.execute("pragma journal_mode=wal").fetchall()
+
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            changesets = 0
+            while changesets < self.maxbatch:
+                try :
+                    entry = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                batch.append(entry)
+                if entry[0] == "changes":
+                    changesets += 1
+
+            failure = self.write(cursor, batch)
+            if failure is not None and self.lost is None:
+                self.lost = failure
+            failure = self.lost
+
+            for kind, data in batch:
+                if kind == "barrier":
+                    if failure is None:
+                        reactor.callFromThread(data.callback, None)
+                    else :
+                        reactor.callFromThread(data.errback, failure)
+                elif kind == "sync":
+                    d, f, args = data
+                    if failure is None:
+                        try :
+                            cursor.execute("pragma wal_checkpoint(truncate)").fetchall()
+                            result = f(*args)
+                        except Exception:
+                            reactor.callFromThread(d.errback, Failure())
+                        else :
+                            reactor.callFromThread(d.callback, result)
+                    else :
+                        reactor.callFromThread(d.errback, failure)
+                elif kind == "stop":
+                    stopping = True
+        connection.close()
+
+
+    def write (self, cursor, batch):
+        """ [internal] applies the change sets of batch in one
+        transaction. Returns None or the Failure, if the batch
+        was dropped """
+        changes = [data for kind, data in batch if kind == "changes"]
+        if not changes:
+            return None
+
+        delay = self.retrydelay
+        retries = 0
+        while True:
+            start = time()
+            try :
+                cursor.execute("begin")
+                for changeset in changes:
+                    for method, statement, args in changeset:
+                        getattr(cursor, method)(statement, args)
+                cursor.execute("commit")
+            except Exception as e:
+                failure = Failure()
+                self.rollback(cursor)
+                self.failures += 1
+                if retries < self.maxretries and self.isTransient(e):
+                    retries += 1
+                    log.err(failure, "persistence writer: retry %d in %.1fs" %
+                                     (retries, delay))
+                    sleep(delay)
+                    delay = min(delay * 2, self.maxdelay)
+                    continue
+                log.err(failure, "persistence writer: batch dropped")
+                return failure
+            self.lastwrite = time() - start
+            self.batches  += 1
+            self.written  += len(changes)
+            return None
+
+
+    def isTransient (self, error):
+        """ [internal] True, if writing again may succeed """
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        message = str(error)
+        for part in self.transient:
+            if part in message:
+                return True
+        return False
+
+
+    def rollback (self, cursor):
+        """ [internal] """
+        try :
+            cursor.execute("rollback")
+        except sqlite3.OperationalError:
+            # no transaction
+            pass
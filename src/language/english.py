@@ -166,6 +166,7 @@ class BasicContext (Context):
         self.addExceptionHandling(CharacterNotFound, "Nobody called by this name is here")
         self.addExceptionHandling(NoSuchDirection, "There is no such direction")
         self.addExceptionHandling(AmbigousDirection, "You are not sure, where to go")
+        self.addExceptionHandling(DungeonUnavailable, "This way is barred to you")
         self.addExceptionHandling(DetailNotFound, "You don't see anything like that")
         self.addExceptionHandling(ItemNotFound, "You can't see an item like that")
         self.addExceptionHandling(ItemNotInUse, "You don't use an item like that")
@@ -186,3 +187,22 @@ class BasicContext (Context):
         self.addExceptionHandling(UneatableItem, "You can't eat that")
         self.addExceptionHandling(UndrinkableItem, "You can't drink that")
         self.addExceptionHandling(UnwearableItem, "You can't wear that")
+
+
+class AdminContext (BasicContext):
+    
+    """ BasicContext with the [admin] actions. Give it to
+    the players, that administer the game """
+    
+    def __init__ (self):
+        BasicContext.__init__(self)
+        semantics = self.semantics
+        self.semantics = []
+        self.addSemantics("^stats$", showCommandStats)
+        self.addSemantics("^profile (.+)$", profileCommands)
+        self.addSemantics("^census$", showCensus)
+        # before the basic semantics (which aren't anchored)
+        self.semantics += semantics
+        
+        self.addExceptionHandling(NoSuchAction, "There is no such action")
+
@@ -166,6 +166,7 @@ class BasicContext (Context):
         self.addExceptionHandling(CharacterNotFound, "Hier ist niemand der so heisst")
         self.addExceptionHandling(NoSuchDirection, "Es gibt keinen solchen Ausgang")
         self.addExceptionHandling(AmbigousDirection, "Du bist dir nicht sicher, wohin du gehen sollst")
+        self.addExceptionHandling(DungeonUnavailable, "Dieser Weg ist dir versperrt")
         self.addExceptionHandling(DetailNotFound, "So etwas siehst du nicht")
         self.addExceptionHandling(ItemNotFound, "Hier ist kein derartiger Gegenstand")
         self.addExceptionHandling(ItemNotInUse, "Du benutzt keinen derartigen Gegenstand")
@@ -186,3 +187,22 @@ class BasicContext (Context):
         self.addExceptionHandling(UneatableItem, "Das kannst du nicht essen")
         self.addExceptionHandling(UndrinkableItem, "Das kannst du nicht trinken")
         self.addExceptionHandling(UnwearableItem, "Das ist kein Kleidungsstueck")
+
+
+class AdminContext (BasicContext):
+    
+    """ BasicContext with the [admin] actions. Give it to
+    the players, that administer the game """
+    
+    def __init__ (self):
+        BasicContext.__init__(self)
+        semantics = self.semantics
+        self.semantics = []
+        self.addSemantics("^statistik$", showCommandStats)
+        self.addSemantics("^profiliere (.+)$", profileCommands)
+        self.addSemantics("^zensus$", showCensus)
+        # before the basic semantics (which aren't anchored)
+        self.semantics += semantics
+        
+        self.addExceptionHandling(NoSuchAction, "Diese Aktion gibt es nicht")
+
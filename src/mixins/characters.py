@@ -15,12 +15,18 @@
 
 from basic.tasks import Fights
 from basic.exceptions import CantAttackThisCharacter
-from mixins.fights import FightFilter
 
 class MilitantCharacter (object):
     
     """ This class extends the Character class by the ability to fight """
     
+    battle = None
+    """ volatile. the Battle the character takes part in (if any) """
+    
+    catchuprounds = 10
+    """ at most this many rounds of fights (one per second) are
+    caught up, when the dungeon wakes up """
+    
     def __init__ (self):
         self.fights = Fights(self)
         self.fights.start(1.0)
@@ -31,6 +37,28 @@ class MilitantCharacter (object):
         self.fights.start(1.0)
     
     
+    def suspend (self):
+        """ stops fights while the dungeon is dormant """
+        if self.fights.running:
+            self.fights.stop()
+    
+    
+    def resume (self, elapsed):
+        """ catches up the rounds of fights, that were missed
+        while the dungeon was dormant (up to catchuprounds), 
+        and restarts fights. Every character catches up its
+        own hits, so the rounds of two opponents aren't
+        interleaved """
+        if self.fights.running or self.battle:
+            return
+        rounds = min(int(elapsed), self.catchuprounds)
+        for i in range(rounds):
+            if not self.fights.opponents:
+                break
+            self.fights.fight()
+        self.fights.start(1.0)
+    
+    
     def getOpponents (self):
         return self.fights.opponents
     
@@ -64,16 +92,13 @@ class MilitantCharacter (object):
         if player doesn't carry any weapon
         @param opponent: opponent in fight 
         """        
-        weaponfound = False
+        # the inventory caches the weapons in use
+        weapons = self.inventory.weapons
         
-        for item in self.inventory.items:
+        for item in weapons:
+            item.inflictDamage(self,opponent)
         
-            #if it is a weapon..
-            if "inflictDamage" in dir(item) and item.isInUse():
-                item.inflictDamage(self,opponent)
-                weaponfound = True
-        
-        if not weaponfound :    
+        if not weapons :    
             # otherwise call default method
             return self.inflictDefaultDamage(opponent)
     
@@ -85,20 +110,22 @@ class MilitantCharacter (object):
         @param value: damage value (int)
         @param constitutiontype: type of constitution
         """
+        battle = self.battle
+        if battle and battle.collecting:
+            # mass combat: the battle resolves
+            # all hits of the round at once
+            battle.stageHit(self, actor, value, constitutiontype)
+            return
+        
         for filter in self.fightfilters:
             value = filter.filter(self,actor,value)
         
-        for c in self.constitution:
-            if isinstance(c,constitutiontype):
-                c.impair(actor,value)
+        for c in self.getConstitutionsOfType(constitutiontype):
+            c.impair(actor,value)
         
     
     def getFightFilters (self):
-        f = []
-        for item in self.inventory.items :
-            if isinstance(item,FightFilter) and item.inuse :
-                f.append(item) 
-        return f
+        return self.inventory.fightfilters
           
     fightfilters = property(getFightFilters)
     
@@ -18,5 +18,26 @@
 
 class FightFilter (object):
     
-    def filter (self,opponent,value):
+    """ 
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Items in use, that alter the damage a character suffers
+    (like shields). Overwrite the filter method or, if the filter
+    just scales and absorbs damage, set linear to True and use
+    factor and absorption. Battles resolve linear filters in bulk,
+    if no other filter follows them (see basic.tasks.Battle).
+    """
+    
+    linear     = False
+    factor     = 1.0
+    absorption = 0
+    
+    def filter (self,character,actor,value):
+        """ returns the damage value character suffers, after
+        actor inflicted value """
+        if self.linear:
+            return max(value*self.factor - self.absorption, 0)
         raise NotImplementedError("Lack of filter method")
\ No newline at end of file
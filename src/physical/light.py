@@ -75,6 +75,8 @@ class LightIntensityListener (SignalListener):
     
     intensity = Integer()
     
+    signaltypes = (LightIntensityChange,)
+    
     def __init__ (self):
         SignalListener.__init__(self)
         self.intensity = 0
@@ -0,0 +1,594 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Headless load generator. Bots connect to a ShmudderProtocol
+server, log in (or register through the RegisterHandler, if
+they are unknown) and play a command mix of walk, take, kill
+and look commands, either random (weighted) or a script file.
+
+Every command is followed by the "ping" sentinel of the test
+server, the time until its answer is the response latency of
+the command. At the end, the server's CommandStats report
+(latencies and errors per action, see GameHandler.handle) is
+fetched and printed with the bot side report.
+
+Runs offline against the test server of this module, that
+serves a world made by tools.worldgen:
+
+    python -m tools.worldgen -r 1000 world.db
+    python -m tools.loadgen serve [-p port] [-t] [-W] [-r rec] world.db
+    python -m tools.loadgen run [-p port] [-c bots] [-d seconds]
+
+@note: Thousands of connections need a file descriptor
+limit above the number of bots (ulimit -n) on both sides.
+"""
+
+import re
+import sys
+import random
+import optparse
+from time import time
+
+from twisted.protocols.basic import LineReceiver
+from twisted.internet.protocol import ClientFactory
+from twisted.internet import reactor
+from twisted.python import log
+
+from engine.ormapping import Store
+from engine.client import ShmudderProtocol, ShmudderFactory
+from engine.client import LoginHandler, RegisterHandler
+from engine.instrumentation import Histogram
+from engine.recorder import SessionRecorder
+from engine.writer import openMirror
+from engine.tick import TickPipeline
+from basic.characters import Player, VitalConstitution
+from basic.rooms import Room
+from mixins.characters import MilitantCharacter
+from language.german import LoginContext, PasswordContext
+from language.german import CharacterChoiceContext, NameChoiceContext
+from language.german import PasswordChoiceContext, AdminContext
+from tools.worldgen import DIRECTIONS, NOUNS, BINS, WALLS, NPCS, getScope
+
+
+PONG     = "pong"
+READY    = "Willkommen im Lasttest"
+UNKNOWN  = "Nie von dir gehoert ! Wie heisst du ?"
+PASSWORD = "Passwort:"
+CHOICE   = "Waehle einen Spielertyp: bot"
+NAME     = "Wie willst du heissen?"
+NEWPASS  = "Bitte gib ein Passwort an:"
+
+MIX = {"walk" : 4, "take" : 2, "kill" : 1, "look" : 3}
+""" default weights of the random command mix """
+
+REPORTLINE = re.compile(r"^\w+: n=\d+ |^\w+ \w+: \d+$")
+""" lines of CommandStats.getReport """
+
+
+# test server
+#################################################
+
+class Health (VitalConstitution):
+    pass
+
+
+def pong (handler, arguments):
+    """ answers the ping sentinel """
+    handler.receiveMessage(PONG)
+
+
+class Quiet (object):
+
+    def showGoodBye (self, handler):
+        pass
+
+
+class BotLoginContext (Quiet, LoginContext):
+
+    def showWelcome (self, handler):
+        handler.receiveMessage("Wie heisst du ? (neu: neuer Spieler)")
+
+
+class BotPasswordContext (Quiet, PasswordContext):
+
+    def showWelcome (self, handler):
+        handler.receiveMessage(PASSWORD)
+
+
+class BotChoiceContext (Quiet, CharacterChoiceContext):
+
+    def showWelcome (self, handler):
+        handler.receiveMessage(CHOICE)
+
+
+class BotNameContext (Quiet, NameChoiceContext):
+
+    def showWelcome (self, handler):
+        handler.receiveMessage(NAME)
+
+
+class BotPasswordChoiceContext (Quiet, PasswordChoiceContext):
+
+    def showWelcome (self, handler):
+        handler.receiveMessage(NEWPASS)
+
+
+class GameContext (Quiet, AdminContext):
+
+    def __init__ (self):
+        AdminContext.__init__(self)
+        self.addSemantics("^ping$", pong)
+
+    def showWelcome (self, handler):
+        handler.receiveMessage(READY)
+
+
+class Bot (MilitantCharacter, Player):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Player type of the test server. Starts in startroom and
+    can't be killed
+    """
+
+    typekeywords = ("bot",)
+
+    startroom = None
+    """ volatile. set by serve """
+
+    def __init__ (self):
+        Player.__init__(self)
+        MilitantCharacter.__init__(self)
+        self.__initdefaults__()
+        self.defaultlocation = Bot.startroom
+        health = Health()
+        health.maxquality = 10**9
+        health.reset()
+        self.addConstitution(health)
+
+
+    def __postload__ (self):
+        Player.__postload__(self)
+        MilitantCharacter.__postload__(self)
+
+
+    def __contextinit__ (self):
+        self.context = GameContext()
+
+
+    @staticmethod
+    def showTypeInfo (handler):
+        handler.receiveMessage("Ein Bot des Lasttests")
+
+
+    def showInfoScreen (self):
+        self.receiveMessage(self.login)
+
+
+    def inflictDefaultDamage (self, opponent):
+        opponent.sufferSimpleDamage(self, 1, Health)
+
+
+class BotLoginHandler (LoginHandler):
+
+    logincontext    = BotLoginContext
+    passwordcontext = BotPasswordContext
+
+
+class BotRegisterHandler (RegisterHandler):
+
+    playertypes     = [Bot]
+    characterchoice = BotChoiceContext
+    namechoice      = BotNameContext
+    passwordchoice  = BotPasswordChoiceContext
+
+
+def setup (path, mirrored=False):
+    """ loads the world in path and sets the handlers of the
+    test server. If mirrored, the world is loaded into memory
+    and a PersistenceWriter writes it back (see openMirror).
+    Returns the store """
+    ShmudderProtocol.loginhandler    = BotLoginHandler
+    ShmudderProtocol.registerhandler = BotRegisterHandler
+
+    if mirrored:
+        s = openMirror(path)
+    else :
+        s = Store(path)
+    scope = getScope()
+    scope.update(Bot=Bot, Health=Health)
+    s.load(scope)
+    rooms = [o for o in s.objects.values() if type(o) is Room]
+    if not rooms:
+        raise SystemExit(path + " contains no rooms")
+    Bot.startroom = min(rooms, key=lambda r: r.id)
+    return s
+
+
+def serve (path, port, pipeline=False, recording=None, mirrored=False):
+    """ loads the world in path and serves it on port (blocks
+    until the reactor stops). If recording is given, the input
+    is recorded into this file (see SessionRecorder) """
+    s = setup(path, mirrored)
+    if pipeline:
+        TickPipeline().start()
+    if recording:
+        recorder = SessionRecorder()
+        recorder.begin(recording).addErrback(log.err, "no recording")
+        reactor.addSystemEventTrigger("before", "shutdown", recorder.end)
+    reactor.addSystemEventTrigger("before", "shutdown", s.commit)
+    reactor.listenTCP(port, ShmudderFactory())
+    print "serving %s on port %d" % (path, port)
+    reactor.run()
+
+
+# bots
+#################################################
+
+def randomCommand (mix, bots):
+    """ returns (kind, command) of the weighted random mix """
+    kind = weightedChoice(mix)
+    if kind == "walk":
+        return kind, random.choice(random.choice(DIRECTIONS))
+    if kind == "take":
+        return kind, "nimm " + random.choice(NOUNS + BINS)
+    if kind == "kill":
+        if random.random() < 0.5:
+            return kind, "toete " + random.choice(NPCS)
+        return kind, "toete bot%d" % random.randrange(bots)
+    if random.random() < 0.5:
+        return kind, "schau"
+    return kind, "unt " + random.choice(WALLS)
+
+
+def weightedChoice (weights):
+    total = sum(weights.values())
+    r = random.uniform(0, total)
+    for key in sorted(weights):
+        r -= weights[key]
+        if r <= 0:
+            return key
+    return key
+
+
+class BotClient (LineReceiver, object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    One bot. Logs in by the prompts of the test server, then
+    sends a command and the ping sentinel, waits for the pong
+    and think seconds (exponentially distributed) and sends the
+    next command. Latencies are recorded in the factory
+    """
+
+    delimiter = "\r\n"
+
+    def __init__ (self, number):
+        self.number  = number
+        self.name    = "bot%d" % number
+        self.state   = "login"
+        self.pending = None
+        self.sent    = None
+        self.script  = 0
+        self.report  = None
+
+
+    def connectionMade (self):
+        self.factory.connected += 1
+        self.sent = time()
+        self.sendLine(self.name)
+
+
+    def lineReceived (self, line):
+        line = line.rstrip()
+        state = self.state
+        if state == "game":
+            if line == PONG:
+                self.answered()
+            elif self.report is not None:
+                self.report.append(line)
+        elif state == "login":
+            # the prompts of the test server
+            if line == UNKNOWN:
+                self.sendLine("neu")
+            elif line == CHOICE:
+                self.sendLine("waehle bot")
+            elif line == NAME:
+                self.sendLine(self.name)
+            elif line in (PASSWORD, NEWPASS):
+                self.sendLine(self.name)
+            elif line == READY:
+                self.state = "game"
+                self.factory.loggedIn(self, time() - self.sent)
+                self.next()
+
+
+    def next (self):
+        """ sends the next command, if the run isn't over """
+        factory = self.factory
+        if factory.stopping:
+            factory.idle(self)
+            return
+        kind, command = factory.nextCommand(self)
+        self.pending = kind
+        self.sent    = time()
+        self.sendLine(command)
+        self.sendLine("ping")
+
+
+    def answered (self):
+        factory = self.factory
+        if self.report is not None:
+            factory.reportReceived(self.report)
+            self.report = None
+            return
+        factory.commandAnswered(self.pending, time() - self.sent)
+        self.pending = None
+        think = factory.think
+        if think:
+            reactor.callLater(random.expovariate(1.0 / think), self.next)
+        else :
+            self.next()
+
+
+    def requestReport (self):
+        self.report = []
+        self.sendLine("statistik")
+        self.sendLine("ping")
+
+
+    def connectionLost (self, reason):
+        state = self.state
+        self.state = "lost"
+        self.factory.lost(self, state)
+
+
+class LoadFactory (ClientFactory):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Connects the bots, collects their latencies and errors and
+    ends the run after duration seconds (after the last bot
+    is logged in). Commands are drawn from the weighted mix or
+    taken in turns from the script lines
+    """
+
+    def __init__ (self, bots, duration, think=0.0, mix=None, script=None):
+        self.bots      = bots
+        self.duration  = duration
+        self.think     = think
+        self.mix       = mix or MIX
+        self.script    = script
+        self.clients   = []
+        self.connected = 0
+        self.failed    = 0
+        self.dropped   = 0
+        self.early     = 0
+        self.logins    = Histogram()
+        self.latencies = {}
+        self.stopping  = False
+        self.start     = None
+        self.end       = None
+        self.waiting   = set()
+        self.serverreport = []
+
+
+    def buildProtocol (self, addr):
+        p = BotClient(len(self.clients))
+        p.factory = self
+        self.clients.append(p)
+        return p
+
+
+    def clientConnectionFailed (self, connector, reason):
+        self.failed += 1
+        self.checkDone()
+
+
+    def nextCommand (self, client):
+        if self.script:
+            command = self.script[client.script % len(self.script)]
+            client.script += 1
+            return command.split()[0], command
+        return randomCommand(self.mix, self.bots)
+
+
+    def loggedIn (self, client, seconds):
+        self.logins.add(seconds)
+        self.checkDone()
+
+
+    def begin (self):
+        """ starts measuring, when every bot is logged in or gone """
+        self.start = time()
+        reactor.callLater(self.duration, self.stop)
+
+
+    def commandAnswered (self, kind, seconds):
+        if self.start is None or self.stopping:
+            return
+        histogram = self.latencies.get(kind)
+        if histogram is None:
+            histogram = Histogram()
+            self.latencies[kind] = histogram
+        histogram.add(seconds)
+
+
+    def stop (self):
+        """ stops sending commands. The bots answer their
+        current command, one of them fetches the server report """
+        self.stopping = True
+        self.end = time()
+        self.waiting = set(c for c in self.clients if c.state == "game")
+        if not self.waiting:
+            self.checkDone()
+
+
+    def idle (self, client):
+        self.waiting.discard(client)
+        if not self.waiting:
+            client.requestReport()
+
+
+    def reportReceived (self, lines):
+        # other players' messages may be mixed in
+        self.serverreport = [l for l in lines if REPORTLINE.match(l)]
+        self.finish()
+
+
+    def lost (self, client, state):
+        if not self.stopping:
+            self.dropped += 1
+            if state == "login":
+                self.early += 1
+        self.waiting.discard(client)
+        self.checkDone()
+
+
+    def checkDone (self):
+        """ [internal] begins or ends the run, if it is time """
+        if self.start is None:
+            if self.logins.count + self.early + self.failed < self.bots:
+                return
+            if self.logins.count:
+                self.begin()
+            else :
+                self.finish()
+        elif self.stopping and not self.waiting:
+            reporting = [c for c in self.clients if c.report is not None]
+            alive = [c for c in self.clients if c.state == "game"]
+            if not alive:
+                self.finish()
+            elif not reporting:
+                alive[0].requestReport()
+
+
+    def finish (self):
+        for c in self.clients:
+            if c.state != "lost":
+                c.transport.loseConnection()
+        if reactor.running:
+            reactor.stop()
+
+
+    def getReport (self):
+        """ returns a list of lines """
+        lines = ["bots: %d connected, %d failed, %d logged in, %d dropped" %
+                 (self.connected, self.failed, self.logins.count, self.dropped)]
+        lines.append(formatHistogram("login", self.logins))
+        total = sum(h.count for h in self.latencies.values())
+        if self.start and self.end:
+            seconds = self.end - self.start
+            lines.append("commands: %d in %.1fs, %.1f/s" %
+                         (total, seconds, total / seconds))
+        for kind in sorted(self.latencies):
+            lines.append(formatHistogram(kind, self.latencies[kind]))
+        lines.append("server:")
+        lines.extend("  " + l for l in self.serverreport)
+        return lines
+
+
+def formatHistogram (name, h):
+    return ("%-6s n=%d mean=%.1fms p50=%.1fms p95=%.1fms p99=%.1fms max=%.1fms" %
+            (name, h.count, h.mean * 1000, h.getPercentile(50) * 1000,
+             h.getPercentile(95) * 1000, h.getPercentile(99) * 1000,
+             h.max * 1000))
+
+
+def run (host, port, bots, duration, rate=100.0, think=0.0,
+         mix=None, script=None):
+    """ runs the bots (blocks until they are done) and returns
+    the factory """
+    factory = LoadFactory(bots, duration, think, mix, script)
+    for n in range(bots):
+        reactor.callLater(n / rate, reactor.connectTCP, host, port, factory)
+    reactor.run()
+    return factory
+
+
+def parseMix (text):
+    """ parses "walk=4,take=2,..." """
+    mix = {}
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        if kind not in MIX:
+            raise ValueError("unknown command kind " + kind)
+        mix[kind] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(usage="python -m tools.loadgen serve [options] world.db\n"
+                                         "       python -m tools.loadgen run [options]")
+    parser.add_option("-H", dest="host", default="localhost")
+    parser.add_option("-p", dest="port", type="int", default=4000)
+    parser.add_option("-t", dest="pipeline", action="store_true",
+                      help="serve: run the TickPipeline")
+    parser.add_option("-W", dest="mirrored", action="store_true",
+                      help="serve: in memory, with a persistence writer")
+    parser.add_option("-r", dest="recording",
+                      help="serve: record the input into this file")
+    parser.add_option("-c", dest="bots", type="int", default=100,
+                      help="run: number of bots")
+    parser.add_option("-d", dest="duration", type="float", default=30.0,
+                      help="run: seconds after the last login")
+    parser.add_option("-R", dest="rate", type="float", default=100.0,
+                      help="run: new connections per second")
+    parser.add_option("-w", dest="think", type="float", default=0.0,
+                      help="run: mean think time between commands")
+    parser.add_option("-m", dest="mix",
+                      help="run: weights like walk=4,take=2,kill=1,look=3")
+    parser.add_option("-f", dest="script",
+                      help="run: file with commands, played in turns")
+    parser.add_option("-s", dest="seed", type="int", default=1)
+    options, args = parser.parse_args()
+
+    if not args or args[0] not in ("serve", "run"):
+        parser.error("serve or run expected")
+
+    if args[0] == "serve":
+        if len(args) != 2:
+            parser.error("no store file given")
+        serve(args[1], options.port, options.pipeline, options.recording,
+              options.mirrored)
+        sys.exit(0)
+
+    random.seed(options.seed)
+    mix = script = None
+    if options.mix:
+        mix = parseMix(options.mix)
+    if options.script:
+        script = [l.strip() for l in open(options.script) if l.strip()]
+
+    factory = run(options.host, options.port, options.bots,
+                  options.duration, options.rate, options.think, mix, script)
+    for line in factory.getReport():
+        print line
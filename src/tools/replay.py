@@ -0,0 +1,256 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Replays a recording of the SessionRecorder against a copy of
+its world snapshot. Every session gets a ShmudderProtocol with
+a fake transport, the lines go through lineReceived to
+GameHandler.handle. The random module is seeded like in the
+recording.
+
+By default the events are replayed as fast as possible,
+without the reactor (timed events, e.g. fight rounds, don't
+happen then). With a speed factor the reactor runs and the
+events are replayed at the recorded times (divided by the
+factor).
+
+The report shows the replay time, the CommandStats report and
+a digest of the output. Equal digests of two versions mean
+equal behaviour. The output of commands, that show timings
+(Replay.undigested, like showCommandStats), is left out of the
+digest.
+
+The game module (-g) must have a setup(path) function, that
+loads the world and sets the handlers of ShmudderProtocol.
+
+Usage: python -m tools.replay [-x speed] [-g module]
+       recording.jsonl [snapshot.db]
+"""
+
+import os
+import sys
+import json
+import random
+import hashlib
+import shutil
+import tempfile
+import optparse
+from time import time
+
+from twisted.internet import reactor
+from twisted.python.failure import Failure
+from twisted.internet.error import ConnectionDone
+
+from engine.client import ShmudderFactory
+from engine.instrumentation import CommandStats
+from engine.recorder import SessionRecorder, fileHash
+
+
+class FakeTransport (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Transport of a replayed session. Adds the output to the
+    digest of the replay
+    """
+
+    def __init__ (self, replay):
+        self.replay = replay
+        self.closed = False
+
+
+    def write (self, data):
+        self.replay.output(data)
+
+
+    def writeSequence (self, data):
+        for d in data:
+            self.write(d)
+
+
+    def loseConnection (self):
+        self.closed = True
+
+    stopProducing = loseConnection
+
+
+class Replay (object):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Replays the events of a recording. The world must be loaded
+    """
+
+    undigested = ("showCommandStats", "profileCommands", "showCensus")
+    """ actions, whose output differs from run to run """
+
+    def __init__ (self, header, events):
+        self.header   = header
+        self.events   = events
+        self.factory  = ShmudderFactory()
+        self.sessions = {}
+        self.digest   = hashlib.sha1()
+        self.digesting = True
+        self.bytes    = 0
+        self.errors   = 0
+        self.start    = None
+        self.end      = None
+
+
+    def output (self, data):
+        if self.digesting:
+            self.digest.update(data)
+        self.bytes += len(data)
+
+
+    def isDigested (self, protocol, line):
+        """ [internal] False, if line runs an undigested action """
+        try :
+            actionf, cargs = protocol.handler.context.parse(line.rstrip())
+        except Exception:
+            return True
+        return actionf.__name__ not in self.undigested
+
+
+    def play (self, event):
+        """ replays one event """
+        t, session, kind, line = event
+        if kind == "open":
+            protocol = self.factory.buildProtocol(None)
+            self.sessions[session] = protocol
+            protocol.makeConnection(FakeTransport(self))
+            return
+
+        protocol = self.sessions.get(session)
+        if protocol is None:
+            return
+        if kind == "line":
+            self.digesting = self.isDigested(protocol, line)
+            try :
+                protocol.lineReceived(line)
+            except Exception:
+                # counted by CommandStats, the server would go on
+                self.errors += 1
+            finally :
+                self.digesting = True
+        elif kind == "close":
+            del self.sessions[session]
+            protocol.connectionLost(Failure(ConnectionDone()))
+
+
+    def run (self, speed=None):
+        """ replays all events, as fast as possible or with the
+        recorded timing divided by speed """
+        random.seed(self.header["seed"])
+        CommandStats().reset()
+        self.start = time()
+        if not speed:
+            for event in self.events:
+                self.play(event)
+            self.finish()
+            return
+
+        for event in self.events:
+            reactor.callLater(event[0] / speed, self.play, event)
+        last = self.events and self.events[-1][0] or 0
+        reactor.callLater(last / speed, self.finish)
+        reactor.run()
+
+
+    def finish (self):
+        # close the sessions, that were open at the end
+        for session, protocol in sorted(self.sessions.items()):
+            protocol.connectionLost(Failure(ConnectionDone()))
+        self.sessions = {}
+        self.end = time()
+        if reactor.running:
+            reactor.stop()
+
+
+    def getReport (self):
+        lines = len([e for e in self.events if e[2] == "line"])
+        recorded = self.events and self.events[-1][0] or 0.0
+        seconds = max(self.end - self.start, 1e-6)
+        report = ["%d lines in %.2fs (%.1f/s), recorded in %.2fs" %
+                  (lines, seconds, lines / seconds, recorded),
+                  "output: %d bytes, digest %s" %
+                  (self.bytes, self.digest.hexdigest()),
+                  "errors: %d" % self.errors]
+        report.extend(CommandStats().getReport())
+        return report
+
+
+def loadRecording (path):
+    """ returns the header and the events of a recording """
+    f = open(path)
+    try :
+        header = json.loads(f.readline())
+        events = [json.loads(l) for l in f if l.strip()]
+    finally :
+        f.close()
+    # JSON gives unicode, the protocol expects byte strings
+    for event in events:
+        if event[3] is not None:
+            event[3] = event[3].encode("utf-8")
+    return header, events
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(usage="python -m tools.replay [options] "
+                                         "recording.jsonl [snapshot.db]")
+    parser.add_option("-x", dest="speed", type="float", default=0.0,
+                      help="replay at recorded speed times this factor "
+                           "(default: as fast as possible)")
+    parser.add_option("-g", dest="game", default="tools.loadgen",
+                      help="module with setup(path)")
+    parser.add_option("-f", dest="force", action="store_true",
+                      help="replay, even if the snapshot id differs")
+    options, args = parser.parse_args()
+
+    if not 1 <= len(args) <= 2:
+        parser.error("no recording given")
+
+    header, events = loadRecording(args[0])
+    snapshot = os.path.join(SessionRecorder.snapshotdir,
+                            header["snapshot"] + ".db")
+    if len(args) == 2:
+        snapshot = args[1]
+    if fileHash(snapshot) != header["snapshot"] and not options.force:
+        sys.exit(snapshot + " is not the snapshot of the recording")
+
+    # the replay alters the world: work on a copy
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    shutil.copyfile(snapshot, path)
+    try :
+        game = __import__(options.game, fromlist=["setup"])
+        game.setup(path)
+        replay = Replay(header, events)
+        replay.run(options.speed)
+        for line in replay.getReport():
+            print line
+    finally :
+        os.remove(path)
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+#    This file is part of Shmudder.
+#
+#    Shmudder is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Shmudder is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Shmudder.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic world generator. Builds a world of the base classes
+(Room, Exit, Dungeon, Item, Container, Detail, Character and
+QuestDungeon) and writes it into a new SQLite store, that can
+be loaded with Store.load(getScope()). The same seed and
+parameters give the same world.
+
+The rooms form a tree with branching exits per room (and a
+way back), grouped into dungeons of dungeonsize rooms. Quest
+dungeons are chains of questrooms rooms hanging off random
+rooms (see GeneratedQuest).
+
+Usage: python -m tools.worldgen [options] world.db
+"""
+
+import os
+import sys
+import random
+import optparse
+from time import time
+
+import engine.locals
+from engine.ormapping import Store, PickleType
+from engine.dbinit import createBaseTables
+from abstract.perception import Detail
+from basic.characters import Character
+from basic.dungeons import Dungeon, QuestDungeon
+from basic.items import Item, Container
+from basic.rooms import Room, Exit
+
+
+DIRECTIONS = [("norden", "sueden"), ("osten", "westen"),
+              ("nordosten", "suedwesten"), ("nordwesten", "suedosten"),
+              ("hoch", "runter")]
+
+NOUNS = ["schwert", "schild", "stein", "buch", "apfel", "fackel",
+         "seil", "krug", "muenze", "ring"]
+
+BINS = ["sack", "kiste", "beutel", "truhe"]
+
+WALLS = ["wand", "boden", "decke", "fenster", "tuer"]
+
+NPCS = ["ork", "zwerg", "wache", "haendler", "ratte"]
+
+
+def describe (thing, keyword):
+    thing.explicit = True
+    thing.shortdescription = "Ein " + keyword
+    thing.longdescription  = "Du siehst einen gewoehnlichen " + keyword
+    thing.addSingularKeyword(keyword)
+
+
+def connect (a, b, n):
+    """ links a and b with the n-th pair of directions """
+    there, back = DIRECTIONS[n % len(DIRECTIONS)]
+    if n >= len(DIRECTIONS):
+        there += str(n)
+        back  += str(n)
+    Exit(a, b).addSingularKeyword(there)
+    Exit(b, a).addSingularKeyword(back)
+
+
+def fill (collection, items, depth, rng=random):
+    """ puts about items items into collection. With depth > 0
+    some of them are containers, that are filled as well """
+    for i in range(rng.randint(0, 2 * items)):
+        if depth and rng.random() < 0.2:
+            item = Container()
+            describe(item, rng.choice(BINS))
+            collection.addItem(item)
+            fill(item, items // 2, depth - 1, rng)
+        else :
+            item = Item()
+            describe(item, rng.choice(NOUNS))
+            collection.addItem(item)
+
+
+def populate (room, items, depth, details, npcs, rng=random):
+    describe(room, "raum")
+    fill(room, items, depth, rng)
+    for d in range(rng.randint(1, details)):
+        detail = Detail()
+        describe(detail, rng.choice(WALLS))
+        room.addDetail(detail)
+    if rng.random() < npcs:
+        npc = Character()
+        npc.__initdefaults__()
+        describe(npc, rng.choice(NPCS))
+        room.addCharacter(npc)
+
+
+class GeneratedQuest (QuestDungeon):
+
+    """
+    @author: Fabian Vallon
+    @license: U{GPL v3<http://www.gnu.org/licenses/>}
+    @version: 0.1
+    @since: 0.1
+
+    Quest dungeon of the generator, a chain of rooms with three
+    tasks. __init__ builds the rooms from layout, a dict of
+    the parameters of populate, the number of rooms and a seed.
+    Clones take the layout of their template (see 
+    QuestDungeon.createClone), so they get the same rooms. The
+    exits of the template rooms, that lead out of the dungeon,
+    are copied to the clone rooms.
+    """
+
+    layout = PickleType()
+
+    def __init__ (self, layout=None):
+        QuestDungeon.__init__(self)
+        template = QuestDungeon.building
+        if template is not None:
+            layout = template.layout
+        self.layout = layout
+
+        rng = random.Random(layout["seed"])
+        previous = None
+        for r in range(layout["rooms"]):
+            room = Room()
+            self.addRoom(room)
+            populate(room, layout["items"], layout["depth"],
+                     layout["details"], layout["npcs"], rng)
+            if previous is not None:
+                connect(previous, room, 0)
+            previous = room
+        for t in range(3):
+            self.addTask("aufgabe%d" % t)
+
+        if template is not None:
+            self.copyExits(template)
+
+
+    def copyExits (self, template):
+        """ [internal] copies the exits of the template rooms,
+        that lead out of template """
+        for room in self.rooms:
+            original = room.template
+            if original is None:
+                continue
+            for exit in original.exits:
+                if exit.direction.dungeon is template:
+                    continue
+                copy = Exit(room, exit.direction)
+                for keyword in exit.skeywords:
+                    copy.addSingularKeyword(keyword)
+
+
+def getScope ():
+    """ returns the scope for Store.load of generated worlds """
+    scope = dict(vars(engine.locals))
+    scope["GeneratedQuest"] = GeneratedQuest
+    return scope
+
+
+def generate (path, rooms=1000, branching=3, items=3, depth=2,
+              details=3, npcs=0.2, quests=2, questrooms=10,
+              dungeonsize=100, seed=1):
+    """ writes a new world into the SQLite file path (an existing
+    file is replaced). Returns the number of objects """
+    random.seed(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    s = Store(path)
+    createBaseTables()
+    GeneratedQuest.createTable()
+
+    world   = []
+    dungeon = None
+    for r in range(rooms):
+        if r % dungeonsize == 0:
+            dungeon = Dungeon()
+        room = Room()
+        dungeon.addRoom(room)
+        populate(room, items, depth, details, npcs)
+        if world:
+            parent = world[(r - 1) // branching]
+            connect(parent, room, (r - 1) % branching)
+        world.append(room)
+
+    for q in range(quests):
+        quest = GeneratedQuest({"rooms" : questrooms, "items" : items,
+                                "depth" : depth, "details" : details,
+                                "npcs" : npcs, 
+                                "seed" : random.randint(0, 2**31)})
+        # the entrance uses a direction of its own
+        entrance = min(quest.rooms, key=lambda r: r.ordinal)
+        connect(random.choice(world), entrance, branching)
+
+    s.commit()
+    return s.cursor.execute("select count(*) from Persistent").fetchone()[0]
+
+
+if __name__ == "__main__":
+
+    parser = optparse.OptionParser(usage="python -m tools.worldgen [options] world.db")
+    parser.add_option("-r", dest="rooms", type="int", default=1000)
+    parser.add_option("-b", dest="branching", type="int", default=3,
+                      help="exits from a room to new rooms")
+    parser.add_option("-i", dest="items", type="int", default=3,
+                      help="mean items per room")
+    parser.add_option("-d", dest="depth", type="int", default=2,
+                      help="maximal nesting depth of containers")
+    parser.add_option("-D", dest="details", type="int", default=3,
+                      help="maximal details per room")
+    parser.add_option("-n", dest="npcs", type="float", default=0.2,
+                      help="npcs per room")
+    parser.add_option("-q", dest="quests", type="int", default=2,
+                      help="number of quest dungeons")
+    parser.add_option("-Q", dest="questrooms", type="int", default=10,
+                      help="rooms per quest dungeon")
+    parser.add_option("-s", dest="seed", type="int", default=1)
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("no store file given")
+
+    start = time()
+    objects = generate(args[0], rooms=options.rooms,
+                       branching=options.branching, items=options.items,
+                       depth=options.depth, details=options.details,
+                       npcs=options.npcs,
+                       quests=options.quests, questrooms=options.questrooms,
+                       seed=options.seed)
+    print "%d objects in %.1f s" % (objects, time() - start)